@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import log
+import metrics
+
+
+class Actors:
+    """Почтовый ящик на каждый чат поверх общего ограниченного пула потоков.
+
+    Команды, нажатия кнопок и дедлайны фаз одного чата выполняются строго по
+    очереди и никогда не пересекаются, разные чаты идут параллельно. Ящик
+    занимает поток не больше чем на batch сообщений подряд, дальше уступает
+    очередь остальным чатам.
+    """
+
+    def __init__(self, workers: int = 8, batch: int = 16):
+        self.batch = batch
+        self._lock = threading.Lock()
+        # chat_id -> deque[(future, func, args, enqueued)]; ящик есть в словаре,
+        # пока он стоит в пуле или обрабатывается
+        self._boxes = {}
+        # chat_id -> секунды обработки, пока ящик не опустел
+        self._busy = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="actor")
+
+    def submit(self, chat_id: int, func, *args) -> Future:
+        future = Future()
+        with self._lock:
+            box = self._boxes.get(chat_id)
+            idle = box is None
+            if idle:
+                box = self._boxes[chat_id] = deque()
+            box.append((future, func, args, time.perf_counter()))
+            depth = len(box)
+        metrics.gauge("actor_queue_depth", depth, chat_id=chat_id)
+        if idle:
+            self._pool.submit(self._drain, chat_id)
+        return future
+
+    def depth(self, chat_id: int) -> int:
+        with self._lock:
+            return len(self._boxes.get(chat_id, ()))
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(box) for box in self._boxes.values())
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True)
+
+    def _drain(self, chat_id: int):
+        for _ in range(self.batch):
+            with self._lock:
+                future, func, args, enqueued = self._boxes[chat_id].popleft()
+            metrics.gauge("actor_queue_depth", self.depth(chat_id), chat_id=chat_id)
+            self._process(chat_id, future, func, args, enqueued)
+            with self._lock:
+                if not self._boxes[chat_id]:
+                    del self._boxes[chat_id]
+                    self._busy.pop(chat_id, None)
+                    # Серия живёт, пока у чата есть работа: метки простаивающих чатов не копятся
+                    metrics.gauge("actor_busy_seconds", 0, chat_id=chat_id)
+                    return
+        # Ящик не опустел за batch сообщений - встаём в конец очереди пула
+        self._pool.submit(self._drain, chat_id)
+
+    def _process(self, chat_id: int, future: Future, func, args: tuple, enqueued: float):
+        if not future.set_running_or_notify_cancel():
+            return
+        began = time.perf_counter()
+        metrics.observe("actor_wait_seconds", began - enqueued)
+        try:
+            future.set_result(func(*args))
+        except Exception as exc:
+            log.exception("actor", "handler failed", chat_id=chat_id, func=getattr(func, "__name__", str(func)))
+            future.set_exception(exc)
+        finally:
+            elapsed = time.perf_counter() - began
+            metrics.observe("actor_process_seconds", elapsed, func=getattr(func, "__name__", "call"))
+            metrics.inc("actor_busy_seconds_total", elapsed)
+            with self._lock:
+                busy = self._busy[chat_id] = self._busy.get(chat_id, 0.0) + elapsed
+            metrics.gauge("actor_busy_seconds", busy, chat_id=chat_id)
@@ -0,0 +1,166 @@
+"""Асинхронный рантайм бота: AsyncTeleBot, long polling или вебхук.
+
+Игровая логика общая с bot.py. Обработчики здесь асинхронные: работа с
+состоянием игры и базой уходит в почтовые ящики чатов (bot.actors), а все
+запросы к Bot API идут через цикл событий, поэтому отправки в разные чаты
+выполняются параллельно.
+
+Запуск:
+    python aiobot.py                 # long polling
+    BOT_MODE=webhook python aiobot.py
+"""
+import asyncio
+import os
+
+from aiohttp import web
+from telebot import asyncio_helper, types
+from telebot.async_telebot import AsyncTeleBot
+
+import bot as core
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+
+if core.API_URL:
+    asyncio_helper.API_URL = core.API_URL.rstrip("/") + "/bot{0}/{1}"
+
+abot = AsyncTeleBot(core.TOKEN)
+
+
+class AsyncBridge:
+    """Синхронный интерфейс TeleBot поверх AsyncTeleBot.
+
+    Отправки не блокируют вызывающий поток: запрос ставится в цикл событий,
+    а вызывающему возвращается Future. Сообщения в один чат уходят строго по
+    порядку, в разные чаты - параллельно.
+    """
+
+    def __init__(self, client: AsyncTeleBot, loop: asyncio.AbstractEventLoop, me: types.User):
+        self.client = client
+        self.loop = loop
+        self.me = me
+        self._locks = {}
+
+    async def _ordered(self, chat_id, coro_factory):
+        entry = self._locks.get(chat_id)
+        if entry is None:
+            entry = self._locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                return await coro_factory()
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(chat_id, None)
+
+    def _submit(self, chat_id, coro_factory):
+        return asyncio.run_coroutine_threadsafe(self._ordered(chat_id, coro_factory), self.loop)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._submit(chat_id, lambda: self.client.send_message(chat_id, text, **kwargs))
+
+    def reply_to(self, message, text, **kwargs):
+        return self._submit(message.chat.id, lambda: self.client.reply_to(message, text, **kwargs))
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        # Файл читаем сразу: вызывающий закроет его до фактической отправки
+        if hasattr(photo, "read"):
+            photo = photo.read()
+        return self._submit(chat_id, lambda: self.client.send_photo(chat_id, photo, **kwargs))
+
+    def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        return asyncio.run_coroutine_threadsafe(
+            self.client.answer_callback_query(callback_query_id, text, show_alert, **kwargs), self.loop)
+
+    def get_chat_member(self, chat_id, user_id):
+        # Результат нужен сразу; вызывается только из потоков обработчиков
+        return asyncio.run_coroutine_threadsafe(
+            self.client.get_chat_member(chat_id, user_id), self.loop).result(timeout=30)
+
+    def get_me(self):
+        return self.me
+
+
+async def run_sync(func, *args):
+    # Обработчики bot.py ставят работу в ящик чата и возвращают Future
+    return await asyncio.wrap_future(func(*args))
+
+
+@abot.callback_query_handler(func=lambda call: call.data.startswith('v|'))
+async def callback_worker(call):
+    await run_sync(core.callback_worker, call)
+
+
+@abot.message_handler(commands=['start'], chat_types=['private'])
+async def start_command(message: types.Message):
+    await run_sync(core.start_command, message)
+
+
+@abot.message_handler(commands=['reg'], chat_types=['group', 'supergroup'])
+async def reg_in_group(message: types.Message):
+    await run_sync(core.reg_in_group, message)
+
+
+@abot.message_handler(commands=['stats'], chat_types=['group', 'supergroup'])
+async def stats_command(message: types.Message):
+    await run_sync(core.stats_command, message)
+
+
+@abot.message_handler(commands=['config'], chat_types=['group', 'supergroup'])
+async def config_command(message: types.Message):
+    await run_sync(core.config_command, message)
+
+
+@abot.message_handler(commands=['stop'], chat_types=['group', 'supergroup'])
+async def game_stop(message: types.Message):
+    await run_sync(core.game_stop, message)
+
+
+@abot.message_handler(commands=['game'], chat_types=['group', 'supergroup'])
+async def game_start(message: types.Message):
+    await run_sync(core.game_start, message)
+
+
+def webhook_app() -> web.Application:
+    tasks = set()
+
+    async def receive(request: web.Request) -> web.Response:
+        if request.match_info["token"] != core.TOKEN:
+            return web.Response(status=403)
+        update = types.Update.de_json(await request.text())
+        # Отвечаем Telegram сразу, обработка идёт в фоне
+        task = asyncio.create_task(abot.process_new_updates([update]))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post("/{token}", receive)
+    return app
+
+
+async def main(mode: str = "polling"):
+    core.metrics.start_from_env()
+    loop = asyncio.get_running_loop()
+    core.bot = AsyncBridge(abot, loop, await abot.get_me())
+    core.recover_games()
+
+    if mode == "webhook":
+        await abot.set_webhook(url=f"{WEBHOOK_URL.rstrip('/')}/{core.TOKEN}")
+        runner = web.AppRunner(webhook_app())
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+            await abot.close_session()
+    else:
+        await abot.delete_webhook()
+        await abot.polling(non_stop=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(os.getenv("BOT_MODE", "polling")))
@@ -1,10 +1,23 @@
-from telebot import TeleBot, types
-from time import sleep 
-from random import choice, sample
-from threading import Timer
+from telebot import TeleBot, apihelper, types
+from time import time
 from dotenv import load_dotenv
+import functools
 import os
+import bots
 import db
+import eventlog
+import history
+import leaderboard
+import lobby
+import log
+import media
+import metrics
+import rules
+from game import Game, writer
+from scheduler import Scheduler
+from outbox import Outbox
+from actors import Actors
+from cache import TTLCache
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MAFIA_IMG = os.path.join(BASE_DIR, "mafia.jpg")
@@ -18,208 +31,260 @@ db.init_db()
 load_dotenv()
 
 TOKEN = os.getenv('TOKEN')
+# Адрес Bot API можно подменить, например на локальную заглушку для тестов
+API_URL = os.getenv('TELEGRAM_API_URL')
+if API_URL:
+    apihelper.API_URL = API_URL.rstrip("/") + "/bot{0}/{1}"
 bot = TeleBot(TOKEN)
 
 games = {}
-
-def get_game_state(chat_id):
-    return games.get(chat_id, {"game": False, "night": False, "timer": None})
-
-def update_game_state(chat_id, key, value):
-    if chat_id not in games:
-        games[chat_id] = {"game": False, "night": False, "timer": None}
-    games[chat_id][key] = value
-
-def get_killed(chat_id, night_flag: bool) -> str:
+events = eventlog.EventLog()
+scheduler = Scheduler()
+outbox = Outbox(lambda: bot)
+# Вся работа с партией идёт через почтовый ящик её чата
+actors = Actors(int(os.getenv('ACTOR_THREADS', '8')))
+# Стратегия ботов-заполнителей; BOT_SEED делает их ходы воспроизводимыми
+bot_strategy = bots.make(os.getenv('BOT_STRATEGY', 'random'), os.getenv('BOT_SEED'))
+# Настройки чата меняет только /config этого же процесса - он и сбрасывает кеш;
+# права админа и имя бота просто живут ограниченное время
+settings_cache = TTLCache("settings", float(os.getenv('SETTINGS_CACHE_TTL', '600')))
+admins_cache = TTLCache("admins", float(os.getenv('ADMIN_CACHE_TTL', '60')))
+identity_cache = TTLCache("get_me", 3600)
+
+def on_chat(key):
+    # Вызов ставится в ящик чата key(arg) и возвращает Future; в одном чате
+    # команды, кнопки и дедлайны фаз выполняются строго по очереди
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(arg, *args):
+            return actors.submit(key(arg), func, arg, *args)
+        return wrapper
+    return decorator
+
+def message_chat(message) -> int:
+    return message.chat.id
+
+def callback_chat(call) -> int:
+    # Ночные голоса приходят из лички, но относятся к чату партии из callback_data
+    try:
+        return int(call.data.split("|")[1])
+    except (IndexError, ValueError):
+        return call.from_user.id
+
+def get_game(chat_id) -> Game:
+    game = games.get(chat_id)
+    if game is None:
+        game = Game(chat_id)
+        game.journal = lambda *event: events.append(chat_id, *event)
+        game = games.setdefault(chat_id, game)
+    return game
+
+def recover_games():
+    # Поднимаем партии, прерванные перезапуском, по их журналам
+    for recovered, deadline in events.recover():
+        chat_id = recovered.chat_id
+        game = get_game(chat_id)
+        recovered.journal = game.journal
+        games[chat_id] = recovered
+        delay = max(0.0, (deadline or time()) - time())
+        recovered.timer = scheduler.call_later(delay, game_loop_step, chat_id, recovered.phase)
+        log.info("game", "recovered", chat_id=chat_id, game_id=recovered.game_id, phase=recovered.phase)
+        outbox.send_message(chat_id, "Бот перезапущен, игра продолжается.")
+
+def get_killed(killed: list, night_flag: bool) -> str:
+    u_killed = ", ".join(killed) if killed else "Никого"
     if not night_flag:
-        u_killed = db.citizen_kill(chat_id)
         return f"Горожане выгнали: {u_killed}"
 
-    u_killed = db.night_resolution(chat_id)
     return f"Этой ночью убиты: {u_killed}"
 
-def autoplay_bots(chat_id, night: bool):
-    players_roles = db.get_players_roles(chat_id) or []
-    alive_usernames = db.get_all_alive(chat_id) or []
-    
-    for player_id, username, role in players_roles:
+def autoplay_bots(game: Game, night: bool):
+    votes = bots.autoplay(game, night, bot_strategy)
+    if not log.enabled(log.DEBUG):
+        return
+    for vote_type, target, player_id in votes:
+        log.debug("bot", "vote", chat_id=game.chat_id, game_id=game.game_id, phase=game.phase,
+                  player_id=player_id, role=game.players[player_id].role, vote_type=vote_type, target_id=target)
 
-        if player_id >= 5: 
-            continue
-        if username not in alive_usernames: 
-            continue
-        
-        targets = [u for u in alive_usernames if u != username]
-        if not targets: 
-            continue
-        target = choice(targets)
-        
-        if not night:
-            db.cast_vote("citizen", target, player_id, chat_id)
-            print(f"[BOT] {username} (Role: {role}) voting 'citizen' -> {target}")
-        else:
-            if role == "mafia":
-                db.cast_vote("mafia", target, player_id, chat_id)
-                print(f"[BOT] {username} (Role: {role}) voting 'mafia' -> {target}")
-            elif role == "doctor":
-                heal_target = choice(alive_usernames)
-                db.cast_vote("doctor", heal_target, player_id, chat_id)
-                print(f"[BOT] {username} (Role: {role}) voting 'doctor' -> {heal_target}")
-            elif role == "sheriff":
-                db.cast_vote("sheriff", target, player_id, chat_id)
-                print(f"[BOT] {username} (Role: {role}) voting 'sheriff' -> {target}")
-            elif role == "maniac":
-                db.cast_vote("maniac", target, player_id, chat_id)
-                print(f"[BOT] {username} (Role: {role}) voting 'maniac' -> {target}")
-
-
-def send_voting_markup(chat_id, vote_type, exclude_name=None):
-    alive = db.get_all_alive(chat_id)
-    markup = types.InlineKeyboardMarkup()
-    for name in alive:
-        if name == exclude_name:
-            continue
-        data = f"vote|{vote_type}|{chat_id}|{name}"
-        markup.add(types.InlineKeyboardButton(text=name, callback_data=data))
+
+def bot_username() -> str:
+    return identity_cache.get(bot, bot.get_me).username
+
+
+def chat_settings(chat_id) -> tuple:
+    # (таймер фазы, число мафий или None - тогда rules.deal_roles берёт 30% стола)
+    return settings_cache.get(chat_id, db.get_settings, chat_id) or (rules.DEFAULT_TIMER, None)
+
+
+def dm(chat_id, user_id, text, notify=False, **kwargs):
+    # Личное сообщение игроку. Если ЛС закрыты и notify=True - просим открыть их в группе
+    # Имя бота берём заранее: on_error может выполняться в потоке event loop
+    mention = bot_username() if notify else None
+
+    def failed(exc):
+        if notify:
+            outbox.send_message(chat_id, f"Откройте ЛС с ботом для получения роли! (@{mention})")
+
+    outbox.send_message(user_id, text, on_error=failed, **kwargs)
+
+
+def send_voting_markup(game: Game, vote_type):
+    # Клавиатура строится один раз на фазу и тип голосования и сразу
+    # сериализуется: все получатели получают одну и ту же строку JSON
+    markup = game.keyboards.get(vote_type)
+    if markup is None:
+        markup = types.InlineKeyboardMarkup()
+        for target_id, name in game.vote_targets(vote_type):
+            data = f"v|{game.chat_id}|{game.game_id or 0}|{game.phase}|{vote_type}|{target_id}"
+            markup.add(types.InlineKeyboardButton(text=name, callback_data=data))
+        markup = game.keyboards[vote_type] = markup.to_json()
     return markup
 
-def game_loop_step(chat_id):
-    state = get_game_state(chat_id)
-    if not state["game"]:
+@on_chat(int)
+@metrics.timed("handler_seconds")
+def game_loop_step(chat_id, phase=None):
+    # phase - фаза, для которой ставился дедлайн: устаревшие вызовы пропускаем
+    game = get_game(chat_id)
+    if not game.active or (phase is not None and phase != game.phase):
         return
 
-    night = state["night"]
+    night = game.night
     
-    msg = get_killed(chat_id, night)
-    bot.send_message(chat_id, msg)
+    result = game.resolve_phase(night)
+    winner = result.winner
 
-    kicked_afk = db.clear_round(chat_id, reset_dead=False, night=night)
-    if kicked_afk:
-        bot.send_message(chat_id, f"Выгнаны за АФК: {', '.join(kicked_afk)}")
+    outbox.send_message(chat_id, get_killed(result.killed, night))
+    if result.kicked:
+        outbox.send_message(chat_id, f"Выгнаны за АФК: {', '.join(result.kicked)}")
 
-    winner = db.check_winner(chat_id)
     if winner:
-        bot.send_message(chat_id, f"Игра окончена: победили {winner}")
-        update_game_state(chat_id, "game", False)
+        outbox.send_message(chat_id, f"Игра окончена: победили {winner}")
+        log.info("game", "finished", chat_id=chat_id, game_id=game.game_id, phase=game.phase, winner=winner)
+        game.active = False
+        events.end(chat_id)
         
         img_path = MAFIA_IMG if winner == "Мафия" or winner == "Маньяк" else CITIZEN_IMG 
-        try:
-            with open(img_path, 'rb') as photo:
-                bot.send_photo(chat_id, photo)
-        except Exception:
-            pass 
+        outbox.call(chat_id, lambda client: media.send_photo(client, chat_id, img_path))
 
-        players = db.get_players_roles(chat_id)
-        for pid, name, role in players:
-            won = False
-            if winner == "Мафия" and role == "mafia": 
-                won = True
-            if winner == "Горожане" and role not in ["mafia", "maniac"]: 
-                won = True
-            if winner == "Маньяк" and role == "maniac": 
-                won = True
-            
-            if pid >= 5:
-                db.add_stats(name, pid, won)
-
-        db.clear_round(chat_id, reset_dead=True)
+        writer.submit(leaderboard.finish_game, chat_id, winner, {role for _, _, role in game.get_players_roles()},
+                      history.record(game, winner))
         return
 
     night = not night
-    update_game_state(chat_id, "night", night)
+    game.night = night
+
+    timer_seconds = chat_settings(chat_id)[0]
+    events.append(chat_id, "t", time() + timer_seconds, night)
     
-    alive = db.get_all_alive(chat_id)
+    alive = result.alive
     alive_str = "\n".join(alive) if alive else "никого"
-    bot.send_message(chat_id, f"В игре:\n{alive_str}")
-
-    settings = db.get_settings(chat_id)
-    timer_seconds = settings[0]
+    outbox.send_message(chat_id, f"В игре:\n{alive_str}")
 
     if night:
-        bot.send_message(chat_id, "Город засыпает. Наступила ночь!")
-        autoplay_bots(chat_id, True)
+        outbox.send_message(chat_id, "Город засыпает. Наступила ночь!")
+        autoplay_bots(game, True)
         
-        players = db.get_players_roles(chat_id)
+        players = game.get_players_roles()
         for pid, name, role in players:
-            if pid < 5: 
+            if pid < rules.BOT_IDS:
                 continue
-            if name not in alive:
+            if pid not in game.alive:
                 continue
             if role in ["mafia", "doctor", "sheriff", "maniac"]:
-                try:
-                    action_name = {
-                        "mafia": "Кого убить?",
-                        "doctor": "Кого лечить?",
-                        "sheriff": "Кого проверить?",
-                        "maniac": "Кого убить?"
-                    }
-                    exclude = name if role != "doctor" else None
-                    bot.send_message(pid, f"Ваша роль: {role}. {action_name[role]}", 
-                                     reply_markup=send_voting_markup(chat_id, role, exclude))
-                except Exception:
-                    pass
+                action_name = {
+                    "mafia": "Кого убить?",
+                    "doctor": "Кого лечить?",
+                    "sheriff": "Кого проверить?",
+                    "maniac": "Кого убить?"
+                }
+                dm(chat_id, pid, f"Ваша роль: {role}. {action_name[role]}", 
+                   reply_markup=send_voting_markup(game, role))
     else:
-        bot.send_message(chat_id, f"День! Обсуждение {timer_seconds} сек. Голосуйте!")
-        bot.send_message(chat_id, "Голосование!", reply_markup=send_voting_markup(chat_id, "citizen"))
-        autoplay_bots(chat_id, False)
+        outbox.send_message(chat_id, f"День! Обсуждение {timer_seconds} сек. Голосуйте!")
+        outbox.send_message(chat_id, "Голосование!", reply_markup=send_voting_markup(game, "citizen"))
+        autoplay_bots(game, False)
 
-    t = Timer(timer_seconds, game_loop_step, args=[chat_id])
-    update_game_state(chat_id, "timer", t)
-    t.start()
+    game.timer = scheduler.call_later(timer_seconds, game_loop_step, chat_id, game.phase)
+    events.flush(chat_id)
+    finish_phase_early(game)
 
 
-@bot.callback_query_handler(func=lambda call: call.data.startswith('vote'))
+def finish_phase_early(game: Game):
+    # Все, кто должен ходить в этой фазе, уже проголосовали - не ждём дедлайна.
+    # Итог фазы ставится в ящик чата следом за текущей работой
+    if game.active and game.timer is not None and game.awaiting() == 0:
+        scheduler.cancel(game.timer)
+        game.timer = None
+        game_loop_step(game.chat_id, game.phase)
+
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith('v|'))
+@on_chat(callback_chat)
+@metrics.timed("handler_seconds")
 def callback_worker(call):
     try:
-        _, vote_type, game_chat_id_str, target = call.data.split("|")
+        _, game_chat_id_str, game_id_str, phase_str, vote_type, target_id_str = call.data.split("|")
         game_chat_id = int(game_chat_id_str)
         user_id = call.from_user.id
         
-        success = db.cast_vote(vote_type, target, user_id, game_chat_id)
+        game = games.get(game_chat_id)
+        target = game.cast_button_vote(vote_type, int(game_id_str), int(phase_str), int(target_id_str),
+                                       user_id) if game else None
+        success = target is not None
         if success:
-            print(f"[PLAYER] {call.from_user.first_name} voted {vote_type} -> {target}")
+            log.info("vote", "vote", chat_id=game_chat_id, game_id=game.game_id, phase=game.phase,
+                     player_id=user_id, vote_type=vote_type, target_id=target.player_id)
         
         if success:
             bot.answer_callback_query(call.id, "Голос принят!")
             if vote_type == "citizen":
-                 bot.send_message(game_chat_id, f"{call.from_user.first_name} проголосовал против {target}")
+                 outbox.send_message(game_chat_id, f"{call.from_user.first_name} проголосовал против {target.username}")
             elif vote_type == "sheriff":
-                target_role = "citizen" 
-                players = db.get_players_roles(game_chat_id)
-                for _, name, role in players:
-                    if name == target:
-                        is_mafia = (role == "mafia")
-                        bot.send_message(user_id, f"Проверка {target}: {'МАФИЯ' if is_mafia else 'Не мафия'}")
-                        break
+                is_mafia = (target.role == "mafia")
+                dm(game_chat_id, user_id, f"Проверка {target.username}: {'МАФИЯ' if is_mafia else 'Не мафия'}")
+            finish_phase_early(game)
         else:
             bot.answer_callback_query(call.id, "Нельзя голосовать (вы мертвы/нет прав/уже голосовали)", show_alert=True)
             
-    except Exception as e:
-        print(f"Callback error: {e}")
+    except Exception:
+        log.exception("callback", "callback failed", chat_id=callback_chat(call), data=call.data)
         bot.answer_callback_query(call.id, "Ошибка")
 
 @bot.message_handler(commands=['start'], chat_types=['private'])
+@on_chat(message_chat)
+@metrics.timed("handler_seconds")
 def start_command(message: types.Message):
-    bot.send_message(message.chat.id, "Привет! Добавь меня в группу.\n/reg - регистрация\n/game - старт\n/stats - статистика")
+    outbox.send_message(message.chat.id, "Привет! Добавь меня в группу.\n/reg - регистрация\n/game - старт\n/stop - остановить игру\n/stats [чат|роль] - статистика")
 
 @bot.message_handler(commands=['reg'], chat_types=['group', 'supergroup'])
+@on_chat(message_chat)
+@metrics.timed("handler_seconds")
 def reg_in_group(message: types.Message):
     chat_id = message.chat.id
-    if get_game_state(chat_id)["game"]:
-        bot.reply_to(message, "Игра уже идёт! Нельзя зарегистрироваться.")
+    if get_game(chat_id).active:
+        outbox.send_message(message.chat.id, "Игра уже идёт! Нельзя зарегистрироваться.", reply_to_message_id=message.message_id)
         return
-    db.insert_player(message.from_user.id, message.from_user.first_name, message.chat.id)
-    bot.reply_to(message, "Вы в игре!")
+    lobby.register(chat_id, message.from_user.id, message.from_user.first_name)
+    outbox.send_message(message.chat.id, "Вы в игре!", reply_to_message_id=message.message_id)
 
 @bot.message_handler(commands=['stats'], chat_types=['group', 'supergroup'])
+@on_chat(message_chat)
+@metrics.timed("handler_seconds")
 def stats_command(message: types.Message):
-    stats = db.get_stats()
-    text = "Топ игроков:\n"
-    for name, games_cnt, wins in stats:
-        text += f"{name}: Игр: {games_cnt}, Побед: {wins}\n"
-    bot.send_message(message.chat.id, text)
+    # /stats - общий топ, /stats чат - топ этого чата, /stats <роль> - топ за роль
+    args = message.text.split()
+    arg = args[1].lower() if len(args) > 1 else ""
+    if arg in ("чат", "chat"):
+        text = leaderboard.render("chat", message.chat.id)
+    elif arg in rules.ROLES:
+        text = leaderboard.render("role", arg)
+    else:
+        text = leaderboard.render()
+    outbox.send_message(message.chat.id, text)
 
 @bot.message_handler(commands=['config'], chat_types=['group', 'supergroup'])
+@on_chat(message_chat)
+@metrics.timed("handler_seconds")
 def config_command(message: types.Message):
     args = message.text.split()
     chat_id = message.chat.id
@@ -227,61 +292,95 @@ def config_command(message: types.Message):
         timer = int(args[1]) if len(args) > 1 else None
         mafia = int(args[2]) if len(args) > 2 else None
         db.update_settings(chat_id, timer, mafia)
-        bot.send_message(chat_id, f"Настройки обновлены: Таймер={timer or 'Без изм.'}, Мафия={mafia or 'Без изм.'}")
+        settings_cache.invalidate(chat_id)
+        outbox.send_message(chat_id, f"Настройки обновлены: Таймер={timer or 'Без изм.'}, Мафия={mafia or 'Без изм.'}")
     except ValueError:
-        bot.send_message(chat_id, "Использование: /config [секунды] [кол-во мафии]")
+        outbox.send_message(chat_id, "Использование: /config [секунды] [кол-во мафии]")
+
+def is_admin(chat_id, user_id) -> bool:
+    try:
+        return admins_cache.get((chat_id, user_id), _fetch_admin, chat_id, user_id)
+    except Exception:
+        return True
+
+def _fetch_admin(chat_id, user_id) -> bool:
+    member = bot.get_chat_member(chat_id, user_id)
+    return member.status in ["administrator", "creator"]
+
+@bot.message_handler(commands=['stop'], chat_types=['group', 'supergroup'])
+@on_chat(message_chat)
+@metrics.timed("handler_seconds")
+def game_stop(message: types.Message):
+    chat_id = message.chat.id
+    game = get_game(chat_id)
+
+    if not game.active:
+        outbox.send_message(chat_id, "Игра не идёт.")
+        return
+
+    if not is_admin(chat_id, message.from_user.id):
+        outbox.send_message(chat_id, "Только админ может остановить игру!")
+        return
+
+    game.active = False
+    scheduler.cancel(game.timer)
+    game.timer = None
+    events.end(chat_id)
+    log.info("game", "stopped", chat_id=chat_id, game_id=game.game_id, phase=game.phase)
+    outbox.send_message(chat_id, "Игра остановлена.")
 
 @bot.message_handler(commands=['game'], chat_types=['group', 'supergroup'])
+@on_chat(message_chat)
+@metrics.timed("handler_seconds")
 def game_start(message: types.Message):
     chat_id = message.chat.id
-    state = get_game_state(chat_id)
+    game = get_game(chat_id)
     
-    if state["game"]:
-        bot.send_message(chat_id, "Игра уже идет!")
+    if game.active:
+        outbox.send_message(chat_id, "Игра уже идет!")
         return
 
-    try:
-        member = bot.get_chat_member(chat_id, message.from_user.id)
-        if member.status not in ["administrator", "creator"]:
-            bot.send_message(chat_id, "Только админ может запустить игру!")
-            return
-    except Exception:
-        pass
+    if not is_admin(chat_id, message.from_user.id):
+        outbox.send_message(chat_id, "Только админ может запустить игру!")
+        return
 
-    update_game_state(chat_id, "game", True)
-    update_game_state(chat_id, "night", False)
+    game.active = True
+    game.night = False
 
-    db.clear_round(chat_id, reset_dead=True)
+    # Дожидаемся итогов прошлой партии, дальше - одна транзакция на весь старт
+    writer.flush()
+    started = lobby.start(chat_id, chat_settings(chat_id)[1])
+    if started is None:
+        game.active = False
+        outbox.send_message(chat_id, "Не удалось начать игру, попробуйте ещё раз.")
+        return
 
-    players_count = db.players_amount(chat_id)
-    if players_count < 5:
-        bot.send_message(chat_id, "Добавляю ботов...")
-        bot_names = ["Вася", "Петя", "Коля", "Света", "Оля", "Катя", "Дима", "Саша", "Лена", "Маша"]
-        chosen = sample(bot_names, 5)
-        for i, name in enumerate(chosen):
-            db.insert_player(i, name, chat_id)
-            sleep(0.1)
+    players_roles, filled = started
+    if filled:
+        outbox.send_message(chat_id, "Добавляю ботов...")
+    game.load(players_roles)
+    game.game_id = int(time() * 1000)
+    events.start(chat_id, game.get_players_roles(), game.game_id)
+    log.info("game", "started", chat_id=chat_id, game_id=game.game_id, players=len(game.players))
     
-    db.set_roles(chat_id)
-    
-    players_roles = db.get_players_roles(chat_id)
-    mafia_usernames = db.get_mafia_usernames(chat_id)
+    players_roles = game.get_players_roles()
+    mafia_usernames = game.get_mafia_usernames()
     
     for player_id, _, role in players_roles:
-        if player_id >= 5:
-            try:
-                bot.send_message(player_id, f"Ваша роль: {role}")
-                if role == 'mafia':
-                    bot.send_message(player_id, f"Мафия: {mafia_usernames}")
-                print(f"[ROLE] User {player_id} is {role}")
-            except:
-                bot.send_message(chat_id, f"Откройте ЛС с ботом для получения роли! (@{bot.get_me().username})")
-
-    bot.send_message(chat_id, "Игра началась! 10 сек на знакомство...")
+        if player_id >= rules.BOT_IDS:
+            dm(chat_id, player_id, f"Ваша роль: {role}", notify=True)
+            if role == 'mafia':
+                dm(chat_id, player_id, f"Мафия: {mafia_usernames}")
+            log.debug("role", "assigned", chat_id=chat_id, game_id=game.game_id, player_id=player_id, role=role)
+
+    outbox.send_message(chat_id, "Игра началась! 10 сек на знакомство...")
     
-    t = Timer(10, game_loop_step, args=[chat_id])
-    update_game_state(chat_id, "timer", t)
-    t.start()
+    game.timer = scheduler.call_later(10, game_loop_step, chat_id, game.phase)
+    events.append(chat_id, "t", time() + 10, False)
+    events.flush(chat_id)
 
 
-bot.polling(non_stop=True)
\ No newline at end of file
+if __name__ == "__main__":
+    metrics.start_from_env()
+    recover_games()
+    bot.polling(non_stop=True)
\ No newline at end of file
@@ -0,0 +1,73 @@
+"""Ходы ботов-заполнителей.
+
+Все голоса ботов за фазу считаются за один проход по состоянию игры в
+памяти и записываются одной пачкой (Game.cast_votes). Стратегии
+детерминированы при заданном seed, поэтому прогоны simulate.py воспроизводимы.
+"""
+import random
+from collections import Counter
+
+import rules
+
+
+class RandomStrategy:
+    """Случайная цель, как раньше делал autoplay_bots."""
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+
+    def choose(self, vote_type: str, voter: int, targets: list, planned: Counter) -> int | None:
+        if vote_type != "doctor":
+            targets = [pid for pid in targets if pid != voter]
+        return self.rng.choice(targets) if targets else None
+
+
+class BandwagonStrategy(RandomStrategy):
+    """Днём и мафией голосует за уже лидирующую цель, иначе случайно."""
+
+    def choose(self, vote_type: str, voter: int, targets: list, planned: Counter) -> int | None:
+        if vote_type in ("citizen", "mafia"):
+            for pid, _ in planned.most_common():
+                if pid != voter:
+                    return pid
+        return super().choose(vote_type, voter, targets, planned)
+
+
+STRATEGIES = {
+    "random": RandomStrategy,
+    "bandwagon": BandwagonStrategy,
+}
+
+
+def make(name: str = "random", seed=None):
+    return STRATEGIES[name](seed)
+
+
+def plan(game, night: bool, strategy) -> list:
+    # [(vote_type, target_id, voter_id)] для всех живых ботов за один проход
+    alive = [pid for pid in game.players if pid in game.alive]
+    planned = {}
+    votes = []
+    for player in game.players.values():
+        if player.player_id >= rules.BOT_IDS or player.player_id not in game.alive:
+            continue
+        if not night:
+            vote_type = "citizen"
+        elif player.role in rules.NIGHT_ROLES:
+            vote_type = player.role
+        else:
+            continue
+
+        counts = planned.setdefault(vote_type, Counter())
+        target = strategy.choose(vote_type, player.player_id, alive, counts)
+        if target is None:
+            continue
+        counts[target] += 1
+        votes.append((vote_type, target, player.player_id))
+    return votes
+
+
+def autoplay(game, night: bool, strategy) -> list:
+    votes = plan(game, night, strategy)
+    game.cast_votes(votes)
+    return votes
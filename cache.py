@@ -0,0 +1,53 @@
+import threading
+import time
+
+import metrics
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Кеш со сквозным чтением: промах вызывает loader, результат живёт ttl секунд.
+
+    ttl=None - до явного invalidate. Исключения loader не кешируются. Если
+    ключ сбросили, пока loader работал, его результат не сохраняется: после
+    invalidate никто не прочитает значение, загруженное до изменения.
+    """
+
+    def __init__(self, name: str, ttl: float = None, size: int = 10000):
+        self.name = name
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        # key -> (value, expires)
+        self._items = {}
+        self._generation = 0
+
+    def get(self, key, loader, *args):
+        now = time.monotonic()
+        with self._lock:
+            value, expires = self._items.get(key, (_MISSING, None))
+            generation = self._generation
+        if value is not _MISSING and (expires is None or now < expires):
+            metrics.inc("cache_hits_total", cache=self.name)
+            return value
+
+        metrics.inc("cache_misses_total", cache=self.name)
+        value = loader(*args)
+        with self._lock:
+            if generation == self._generation:
+                self._items.pop(key, None)
+                if len(self._items) >= self.size:
+                    # Самая старая запись - первая в словаре
+                    del self._items[next(iter(self._items))]
+                self._items[key] = (value, None if self.ttl is None else now + self.ttl)
+        return value
+
+    def invalidate(self, key=_MISSING) -> None:
+        # Без ключа сбрасывает весь кеш
+        with self._lock:
+            self._generation += 1
+            if key is _MISSING:
+                self._items.clear()
+            else:
+                self._items.pop(key, None)
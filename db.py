@@ -1,43 +1,165 @@
 import sqlite3 
-import random
+import heapq
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from traceback import print_exc
+from queue import LifoQueue, Empty
 import os
+import time
+
+import log
+import metrics
+import rules
 
 
 BASE_DIR = Path(__file__).resolve().parent
-DB_PATH = BASE_DIR / "db.db"
+DB_PATH = Path(os.getenv("DB_PATH", BASE_DIR / "db.db"))
+
+# Сколько соединений держим открытыми одновременно (голоса идут из потока
+# polling, фазы - из потоков таймеров)
+POOL_SIZE = 8
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA foreign_keys=OFF",
+)
+# Вызываются для каждого нового соединения
+CONNECT_HOOKS = []
+
+# При шардировании (shards.py) - файлы всех шардов. Общие рейтинги
+# собираются из них на чтение, по соединению на шард
+SHARDS = [Path(p) for p in os.getenv("DB_SHARDS", "").split(os.pathsep) if p]
+
+# Счётчик выполненных SQL-запросов в текущем потоке (для метрик)
+_calls = threading.local()
+
+
+def _trace(sql: str) -> None:
+    if sql.startswith("COMMIT"):
+        metrics.inc("db_commits_total")
+    elif not sql.startswith(("BEGIN", "ROLLBACK")):
+        _calls.statements = getattr(_calls, "statements", 0) + 1
+
+
+class ConnectionPool:
+    """Ограниченный пул постоянных соединений к SQLite.
+
+    Поток получает соединение на время вызова и возвращает его обратно,
+    вложенные вызовы в том же потоке переиспользуют уже взятое соединение.
+    """
+
+    def __init__(self, path, size: int = POOL_SIZE):
+        self.path = str(path)
+        self.size = size
+        self._idle = LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        if metrics.ENABLED:
+            conn.set_trace_callback(_trace)
+        for hook in CONNECT_HOOKS:
+            hook(conn)
+        with self._lock:
+            self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def acquire(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            # Вложенный вызов: транзакцией управляет внешний
+            yield conn, False
+            return
+
+        began = time.perf_counter()
+        self._slots.acquire()
+        metrics.observe("db_pool_wait_seconds", time.perf_counter() - began)
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except Empty:
+                conn = self._open()
+            self._local.conn = conn
+            try:
+                yield conn, True
+            finally:
+                self._local.conn = None
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            conn.close()
+        self._idle = LifoQueue()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.path != str(DB_PATH):
+            if _pool is not None:
+                _pool.close()
+            _pool = ConnectionPool(DB_PATH)
+        return _pool
+
+
+def close_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
 
 
 def connect(func):
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect(str(DB_PATH))
-        cur = conn.cursor()
-        result = None
-        try:
-            result = func(cur, *args, **kwargs)
-            conn.commit()
-        except Exception:
-            conn.rollback()
-            print(f"[ERROR]: {func.__name__}:")
-            print_exc()
-        finally:
-            conn.close()
-        return result
+        with get_pool().acquire() as (conn, owner):
+            cur = conn.cursor()
+            if not owner:
+                return func(cur, *args, **kwargs)
+            result = None
+            began = time.perf_counter()
+            statements = getattr(_calls, "statements", 0)
+            try:
+                result = func(cur, *args, **kwargs)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                metrics.inc("db_errors_total", func=func.__name__)
+                log.exception("db", "query failed", func=func.__name__)
+            finally:
+                cur.close()
+                metrics.observe("db_call_seconds", time.perf_counter() - began, func=func.__name__)
+                metrics.inc("db_statements_total", getattr(_calls, "statements", 0) - statements,
+                            func=func.__name__)
+            return result
+    wrapper.__name__ = func.__name__
+    wrapper.__doc__ = func.__doc__
     return wrapper
 
  
-@connect
-def init_db(cur):
-    # Удаляем старую таблицу если она существует
-    cur.execute("DROP TABLE IF EXISTS players")
-    cur.execute("DROP TABLE IF EXISTS votes")
-    cur.execute("DROP TABLE IF EXISTS stats")
-    cur.execute("DROP TABLE IF EXISTS settings")
-    
-    # Создаем таблицы заново с правильной структурой
-    cur.execute("""
-        CREATE TABLE players (
+# Миграции схемы: индекс в списке + 1 = номер версии (PRAGMA user_version).
+# Новые изменения схемы добавляются только в конец списка.
+MIGRATIONS = [
+    (
+        """
+        CREATE TABLE IF NOT EXISTS players (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             player_id INTEGER,
             username TEXT,
@@ -47,285 +169,309 @@ def init_db(cur):
             voted INTEGER DEFAULT 0,
             afk_count INTEGER DEFAULT 0,
             UNIQUE(player_id, chat_id)
-        )""")
-    
-    cur.execute("""
-        CREATE TABLE votes (
+        )""",
+        """
+        CREATE TABLE IF NOT EXISTS votes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             vote_type TEXT NOT NULL,
             target_name TEXT NOT NULL,
             voted_id INTEGER NOT NULL,
             chat_id INTEGER NOT NULL,
             FOREIGN KEY (voted_id) REFERENCES players(id))
-    """)
-
-    cur.execute("""
-        CREATE TABLE stats (
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats (
             user_id INTEGER PRIMARY KEY,
             username TEXT,
             games INTEGER DEFAULT 0,
             wins INTEGER DEFAULT 0
         )
-    """)
-
-    cur.execute("""
-        CREATE TABLE settings (
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS settings (
             chat_id INTEGER PRIMARY KEY,
             timer_seconds INTEGER DEFAULT 30,
             mafia_count INTEGER DEFAULT 1
         )
-    """)
+        """,
+    ),
+    (
+        # Подсчёт голосов по типу: GROUP BY target_name без обращения к таблице
+        "CREATE INDEX IF NOT EXISTS idx_votes_chat_type ON votes(chat_id, vote_type, target_name)",
+        # Живые игроки чата и подсчёт по ролям
+        "CREATE INDEX IF NOT EXISTS idx_players_chat_dead ON players(chat_id, dead, role, username)",
+        # Обновления по имени игрока
+        "CREATE INDEX IF NOT EXISTS idx_players_chat_username ON players(chat_id, username)",
+        # Топ игроков без сортировки всей таблицы
+        "CREATE INDEX IF NOT EXISTS idx_stats_wins ON stats(wins DESC, username, games)",
+    ),
+    (
+        # Рейтинги по чатам и по ролям, обновляются в finish_game
+        """
+        CREATE TABLE IF NOT EXISTS chat_stats (
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            games INTEGER DEFAULT 0,
+            wins INTEGER DEFAULT 0,
+            PRIMARY KEY (chat_id, user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_chat_stats_wins ON chat_stats(chat_id, wins DESC, username, games)",
+        """
+        CREATE TABLE IF NOT EXISTS role_stats (
+            role TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            username TEXT,
+            games INTEGER DEFAULT 0,
+            wins INTEGER DEFAULT 0,
+            PRIMARY KEY (role, user_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_role_stats_wins ON role_stats(role, wins DESC, username, games)",
+    ),
+    (
+        # file_id уже загруженных в Telegram картинок
+        "CREATE TABLE IF NOT EXISTS media (name TEXT PRIMARY KEY, file_id TEXT NOT NULL)",
+    ),
+    (
+        # Голоса живут только в памяти партии (Game): таблица больше не нужна
+        "DROP TABLE IF EXISTS votes",
+        # Игроки обновляются по (player_id, chat_id) через UNIQUE-индекс
+        "DROP INDEX IF EXISTS idx_players_chat_username",
+    ),
+    (
+        # Архив сыгранных партий: строка на партию. Колонки - всё, что нужно
+        # агрегатам (history.py), по игрокам - упакованный roster
+        """
+        CREATE TABLE IF NOT EXISTS games (
+            id INTEGER PRIMARY KEY,
+            chat_id INTEGER NOT NULL,
+            started INTEGER,
+            finished INTEGER NOT NULL,
+            winner INTEGER NOT NULL,
+            phases INTEGER NOT NULL,
+            players INTEGER NOT NULL,
+            bots INTEGER NOT NULL,
+            kicked INTEGER NOT NULL,
+            citizen INTEGER NOT NULL,
+            mafia INTEGER NOT NULL,
+            doctor INTEGER NOT NULL,
+            sheriff INTEGER NOT NULL,
+            maniac INTEGER NOT NULL,
+            roster BLOB NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_games_chat ON games(chat_id, mafia)",
+    ),
+]
 
 
 @connect
-def insert_player(cur, player_id: int, username: str, chat_id: int) -> None:
-    cur.execute("""
-    INSERT OR REPLACE INTO players(player_id, username, chat_id, dead, voted, afk_count)
-    VALUES (?, ?, ?, COALESCE((SELECT dead FROM players WHERE player_id=? AND chat_id=?), 0), 0, 0)
-    """, (player_id, username, chat_id, player_id, chat_id))
+def init_db(cur):
+    # Обновляем схему на месте, данные между перезапусками сохраняются
+    cur.execute("BEGIN IMMEDIATE")
+    cur.execute("PRAGMA user_version")
+    version = cur.fetchone()[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        for statement in statements:
+            cur.execute(statement)
+        cur.execute(f"PRAGMA user_version = {number}")
+
+
+# Повторная регистрация только обновляет имя
+UPSERT_PLAYER = """
+    INSERT INTO players(player_id, username, chat_id) VALUES (?, ?, ?)
+    ON CONFLICT(player_id, chat_id) DO UPDATE SET username=excluded.username, voted=0, afk_count=0
+"""
+
+
+def _deal_roles(cur, chat_id: int, mafia_count: int = None) -> list:
+    # Раздаёт роли всем игрокам чата одним executemany, возвращает [(player_id, username, role)]
+    cur.execute("SELECT player_id, username FROM players WHERE chat_id=? ORDER BY player_id", (chat_id,))
+    players = cur.fetchall()
+    if not players:
+        return []
+    roles = rules.deal_roles(len(players), mafia_count)
+    cur.executemany("UPDATE players SET role=?, dead=0, voted=0, afk_count=0 WHERE player_id=? AND chat_id=?",
+                    [(role, player_id, chat_id) for (player_id, _), role in zip(players, roles)])
+    return [(player_id, username, role) for (player_id, username), role in zip(players, roles)]
 
 
 @connect
-def players_amount(cur, chat_id: int) -> int:
+def start_game(cur, chat_id: int, registrations: list, bot_names: list, mafia_count: int = None) -> tuple:
+    """Старт партии одной транзакцией: регистрации из лобби, боты-заполнители и роли.
+
+    registrations - [(player_id, username)], bot_names - имена ботов на случай,
+    если игроков меньше rules.MIN_PLAYERS, mafia_count - из настроек чата
+    (None - по умолчанию). Возвращает ([(player_id, username, role)], добавлены ли боты).
+    """
+    cur.execute("BEGIN IMMEDIATE")
+    cur.executemany(UPSERT_PLAYER, [(player_id, username, chat_id) for player_id, username in registrations])
     cur.execute("SELECT COUNT(*) FROM players WHERE chat_id=?", (chat_id,))
-    result = cur.fetchone()
-    return result[0] if result else 0
+    filled = cur.fetchone()[0] < rules.MIN_PLAYERS
+    if filled:
+        cur.executemany(UPSERT_PLAYER, [(i, name, chat_id) for i, name in enumerate(bot_names[:rules.BOT_IDS])])
+    return _deal_roles(cur, chat_id, mafia_count), filled
 
 
 @connect
-def get_mafia_usernames(cur, chat_id: int) -> str:
-    cur.execute("SELECT username FROM players WHERE role = 'mafia' AND dead = 0 AND chat_id=?", (chat_id,))
-    rows = cur.fetchall()
-    return "\n".join(row[0] for row in rows)
+def finish_game(cur, chat_id: int, winner: str, archive: tuple = None) -> None:
+    # Итоги партии: статистика всех участников одним UPSERT, строка архива
+    # (history.record) и сброс раунда в той же транзакции
+    cur.execute("BEGIN IMMEDIATE")
+    if archive is not None:
+        cur.execute(f"""
+            INSERT INTO games(chat_id, started, finished, winner, phases, players, bots, kicked,
+                              {", ".join(rules.ROLES)}, roster)
+            VALUES ({", ".join("?" * (9 + len(rules.ROLES)))})
+        """, archive)
+    cur.execute("SELECT player_id, username, role FROM players WHERE chat_id=? AND player_id >= ?",
+                (chat_id, rules.BOT_IDS))
+    results = [(pid, name, role, int(rules.faction(role) == winner)) for pid, name, role in cur.fetchall()]
+    cur.executemany("""
+        INSERT INTO stats(user_id, username, games, wins) VALUES (?, ?, 1, ?)
+        ON CONFLICT(user_id) DO UPDATE SET games = games + 1, wins = wins + excluded.wins,
+            username = excluded.username
+    """, [(pid, name, won) for pid, name, role, won in results])
+    cur.executemany("""
+        INSERT INTO chat_stats(chat_id, user_id, username, games, wins) VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT(chat_id, user_id) DO UPDATE SET games = games + 1, wins = wins + excluded.wins,
+            username = excluded.username
+    """, [(chat_id, pid, name, won) for pid, name, role, won in results])
+    cur.executemany("""
+        INSERT INTO role_stats(role, user_id, username, games, wins) VALUES (?, ?, ?, 1, ?)
+        ON CONFLICT(role, user_id) DO UPDATE SET games = games + 1, wins = wins + excluded.wins,
+            username = excluded.username
+    """, [(role, pid, name, won) for pid, name, role, won in results])
+    cur.execute("UPDATE players SET dead=0, voted=0, afk_count=0 WHERE chat_id=?", (chat_id,))
+
+
+def _history_filter(chat_id: int | None) -> tuple:
+    return ("WHERE chat_id=?", (chat_id,)) if chat_id is not None else ("", ())
 
 
 @connect
-def get_players_roles(cur, chat_id: int) -> list:
-    cur.execute("SELECT player_id, username, role FROM players WHERE chat_id=?", (chat_id,))
-    return cur.fetchall()
+def get_history_summary(cur, chat_id: int = None) -> tuple:
+    # (партий, средняя длина в фазах, выгнано за АФК, всего игроков, побед по rules.WINNERS...)
+    where, params = _history_filter(chat_id)
+    wins = ", ".join(f"TOTAL(winner={code})" for code in range(len(rules.WINNERS)))
+    cur.execute(f"SELECT COUNT(*), AVG(phases), TOTAL(kicked), TOTAL(players), {wins} FROM games {where}", params)
+    return cur.fetchone()
 
 
 @connect
-def get_all_alive(cur, chat_id: int) -> list:
-    cur.execute("SELECT username FROM players WHERE dead=0 AND chat_id=?", (chat_id,))
-    return [row[0] for row in cur.fetchall()] 
+def get_role_win_rates(cur, chat_id: int = None) -> list:
+    # [(роль, сыграно, побед)]: один проход по архиву, считает SQLite
+    where, params = _history_filter(chat_id)
+    columns = ", ".join(
+        f"TOTAL({role}), TOTAL(CASE WHEN winner={rules.WINNERS.index(rules.faction(role))} THEN {role} END)"
+        for role in rules.ROLES
+    )
+    cur.execute(f"SELECT {columns} FROM games {where}", params)
+    row = cur.fetchone()
+    return [(role, int(row[2 * i]), int(row[2 * i + 1])) for i, role in enumerate(rules.ROLES)]
 
 
 @connect
-def set_roles(cur, chat_id: int) -> None:
-    cur.execute("SELECT player_id FROM players WHERE chat_id=? ORDER BY player_id", (chat_id,))
-    players_rows = cur.fetchall()
-    n = len(players_rows)
-    if n == 0:
-        return 
-    
-    cur.execute("SELECT mafia_count FROM settings WHERE chat_id=?", (chat_id,))
-    res = cur.fetchone()
-    mafia_count = res[0] if res else max(1, int(n * 0.3))
-
-    roles = ["mafia"] * mafia_count
-    
-    special_roles = []
-    if n >= 5: 
-        special_roles.append("doctor")
-    if n >= 6: 
-        special_roles.append("sheriff")
-    if n >= 7: 
-        special_roles.append("maniac")
-
-    assigned_count = len(roles) + len(special_roles)
-    if assigned_count > n:
-        special_roles = special_roles[:n-len(roles)]
-    
-    roles.extend(special_roles)
-    roles.extend(["citizen"] * (n - len(roles)))
-    
-    random.shuffle(roles)
-    
-    for (player_id,), role in zip(players_rows, roles):
-        cur.execute("UPDATE players SET role=?, dead=0, voted=0, afk_count=0 WHERE player_id=? AND chat_id=?", (role, player_id, chat_id))
+def get_mafia_balance(cur, chat_id: int = None) -> list:
+    # [(мафий в партии, партий, средняя длина, побед по rules.WINNERS...)]
+    where, params = _history_filter(chat_id)
+    wins = ", ".join(f"TOTAL(winner={code})" for code in range(len(rules.WINNERS)))
+    cur.execute(f"SELECT mafia, COUNT(*), AVG(phases), {wins} FROM games {where} GROUP BY mafia ORDER BY mafia",
+                params)
+    return cur.fetchall()
 
 
 @connect
-def user_exists(cur, player_id: int, chat_id: int) -> bool:
-    cur.execute("SELECT 1 FROM players WHERE player_id=? AND chat_id=?", (player_id, chat_id))
-    return cur.fetchone() is not None
+def get_stats(cur) -> list:
+    cur.execute("SELECT username, games, wins FROM stats ORDER BY wins DESC LIMIT 10")
+    return cur.fetchall()
 
 
 @connect
-def cast_vote(cur, vote_type: str, target_name: str, voted_id: int, chat_id: int) -> bool:
-    cur.execute("SELECT dead, voted, role FROM players WHERE player_id = ? AND chat_id=?", (voted_id, chat_id))
-    row = cur.fetchone()
-    if not row: 
-        return False
-    dead, voted, role = row 
-    
-    if dead != 0 or voted != 0: 
-        return False 
-
-    if vote_type == "mafia" and role != "mafia": 
-        return False
-    if vote_type == "doctor" and role != "doctor": 
-        return False
-    if vote_type == "sheriff" and role != "sheriff": 
-        return False
-    if vote_type == "maniac" and role != "maniac": 
-        return False
-
-    cur.execute("SELECT 1 FROM players WHERE username = ? AND dead = 0 AND chat_id=?", (target_name, chat_id))
-    if not cur.fetchone(): 
-        return False
-    
-    cur.execute("INSERT INTO votes (vote_type, target_name, voted_id, chat_id) VALUES (?, ?, ?, ?)", 
-                (vote_type, target_name, voted_id, chat_id))
-    cur.execute("UPDATE players SET voted = 1 WHERE player_id = ? AND chat_id=?", (voted_id, chat_id))
-    return True 
+def get_chat_stats(cur, chat_id: int) -> list:
+    cur.execute("SELECT username, games, wins FROM chat_stats WHERE chat_id=? ORDER BY wins DESC LIMIT 10",
+                (chat_id,))
+    return cur.fetchall()
 
 
 @connect
-def night_resolution(cur, chat_id: int) -> str:
-    cur.execute("""SELECT target_name FROM votes WHERE vote_type='mafia' AND chat_id=? 
-                   GROUP BY target_name ORDER BY COUNT(*) DESC LIMIT 1""", (chat_id,))
-    mafia_target = cur.fetchone()
-    mafia_target = mafia_target[0] if mafia_target else None
-
-    cur.execute("""SELECT target_name FROM votes WHERE vote_type='maniac' AND chat_id=? 
-                   GROUP BY target_name ORDER BY COUNT(*) DESC LIMIT 1""", (chat_id,))
-    maniac_target = cur.fetchone()
-    maniac_target = maniac_target[0] if maniac_target else None
-
-    cur.execute("""SELECT target_name FROM votes WHERE vote_type='doctor' AND chat_id=? 
-                   GROUP BY target_name ORDER BY COUNT(*) DESC LIMIT 1""", (chat_id,))
-    doctor_target = cur.fetchone()
-    doctor_target = doctor_target[0] if doctor_target else None
-
-    dead_list = []
-    
-    if mafia_target:
-        if mafia_target != doctor_target:
-            dead_list.append(mafia_target)
-    
-    if maniac_target:
-        if maniac_target != doctor_target:
-            dead_list.append(maniac_target)
-    
-    dead_list = list(set(dead_list))
-    for username in dead_list:
-        cur.execute("UPDATE players SET dead = 1 WHERE username = ? AND chat_id=?", (username, chat_id))
-    
-    return ", ".join(dead_list) if dead_list else "Никого"
+def get_role_stats(cur, role: str) -> list:
+    cur.execute("SELECT username, games, wins FROM role_stats WHERE role=? ORDER BY wins DESC LIMIT 10", (role,))
+    return cur.fetchall()
 
 
-@connect
-def citizen_kill(cur, chat_id: int) -> str:
-    cur.execute("""
-        SELECT target_name, COUNT(*) AS count
-        FROM votes 
-        WHERE vote_type='citizen' AND chat_id = ?
-        GROUP BY target_name 
-        ORDER BY count DESC
-        LIMIT 2
-    """, (chat_id,))
-    rows = cur.fetchall()
-    if not rows: 
-        return "Никого"
-    
-    top = rows[0]
-    if len(rows) > 1 and rows[1][1] == top[1]: 
-        return "Никого"
-
-    cur.execute("UPDATE players SET dead = 1 WHERE username = ? AND chat_id=?", (top[0], chat_id))
-    return top[0]
+def _merged(query: str, params: tuple = ()) -> list:
+    # Игрок мог играть в чатах разных шардов: складываем его строки по user_id.
+    # Каждый шард читается своим соединением, так что их число не ограничено ATTACH
+    totals = {}
+    for path in SHARDS:
+        try:
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                rows = conn.execute(query, params).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            # Шард ещё не создан своим воркером
+            log.warning("db", "shard unavailable", path=str(path))
+            continue
+        for user_id, username, games, wins in rows:
+            _, total_games, total_wins = totals.get(user_id, (None, 0, 0))
+            totals[user_id] = (username, total_games + games, total_wins + wins)
+    return heapq.nlargest(10, totals.values(), key=lambda row: row[2])
 
 
-@connect
-def check_winner(cur, chat_id: int) -> str | None:
-    cur.execute("SELECT COUNT(*) FROM players WHERE role='mafia' AND dead=0 AND chat_id=?", (chat_id,))
-    mafia_alive = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(*) FROM players WHERE role='maniac' AND dead=0 AND chat_id=?", (chat_id,))
-    maniac_alive = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(*) FROM players WHERE role!='mafia' AND role!='maniac' AND dead=0 AND chat_id=?", (chat_id,))
-    citizen_alive = cur.fetchone()[0]
-
-    if maniac_alive > 0 and mafia_alive == 0 and citizen_alive <= 1:
-        return "Маньяк"
-
-    if mafia_alive >= (citizen_alive + maniac_alive) and mafia_alive > 0:
-        return "Мафия"
-    
-    if mafia_alive == 0 and maniac_alive == 0:
-        return "Горожане"
-    
-    return None
+def get_merged_stats() -> list:
+    return _merged("SELECT user_id, username, games, wins FROM stats")
 
 
-@connect
-def clear_round(cur, chat_id: int, reset_dead: bool = False, night: bool = None) -> list:
-    kicked_list = []
-    if not reset_dead:
-        query = "SELECT username, afk_count FROM players WHERE voted=0 AND dead=0 AND chat_id=?"
-        params = [chat_id]
-        if night:
-            query = "SELECT username, afk_count FROM players WHERE voted=0 AND dead=0 AND chat_id=? AND role != 'citizen'"
-
-        cur.execute(query, params)
-        afk_players = cur.fetchall()
-        for username, count in afk_players:
-            new_count = count + 1
-            if new_count >= 2:
-                cur.execute("UPDATE players SET dead=1 WHERE username=? AND chat_id=?", (username, chat_id))
-                kicked_list.append(username)
-            else:
-                cur.execute("UPDATE players SET afk_count=? WHERE username=? AND chat_id=?", (new_count, username, chat_id))
-        
-    cur.execute("UPDATE players SET voted=0 WHERE chat_id=?", (chat_id,))
-    cur.execute("DELETE FROM votes WHERE chat_id=?", (chat_id,))
-
-    if reset_dead:
-        cur.execute("UPDATE players SET dead=0, voted=0, afk_count=0 WHERE chat_id=?", (chat_id,))
-    
-    return kicked_list
+def get_merged_role_stats(role: str) -> list:
+    return _merged("SELECT user_id, username, games, wins FROM role_stats WHERE role=?", (role,))
 
 
 @connect
-def add_stats(cur, username: str, user_id: int, win: bool):
-    cur.execute("INSERT OR IGNORE INTO stats(user_id, username) VALUES(?, ?)", (user_id, username))
-    cur.execute("UPDATE stats SET games = games + 1 WHERE user_id=?", (user_id,))
-    if win:
-        cur.execute("UPDATE stats SET wins = wins + 1 WHERE user_id=?", (user_id,))
+def get_media_id(cur, name: str) -> str | None:
+    cur.execute("SELECT file_id FROM media WHERE name=?", (name,))
+    row = cur.fetchone()
+    return row[0] if row else None
 
 
 @connect
-def get_stats(cur) -> list:
-    cur.execute("SELECT username, games, wins FROM stats ORDER BY wins DESC LIMIT 10")
-    return cur.fetchall()
+def set_media_id(cur, name: str, file_id: str | None) -> None:
+    if file_id is None:
+        cur.execute("DELETE FROM media WHERE name=?", (name,))
+    else:
+        cur.execute("INSERT OR REPLACE INTO media(name, file_id) VALUES (?, ?)", (name, file_id))
 
 
 @connect
-def get_settings(cur, chat_id: int) -> tuple:
+def get_settings(cur, chat_id: int) -> tuple | None:
+    # (timer_seconds, mafia_count) или None, если чат не настраивали
     cur.execute("SELECT timer_seconds, mafia_count FROM settings WHERE chat_id=?", (chat_id,))
-    res = cur.fetchone()
-    if not res:
-        cur.execute("INSERT INTO settings(chat_id) VALUES(?)", (chat_id,))
-        return (30, 1)
-    return res
+    return cur.fetchone()
 
 
 @connect
 def update_settings(cur, chat_id: int, timer: int = None, mafia: int = None):
     if timer is not None:
         cur.execute("""
-            INSERT OR REPLACE INTO settings(chat_id, timer_seconds, mafia_count) 
-            VALUES (?, ?, COALESCE((SELECT mafia_count FROM settings WHERE chat_id=?), 1))
-        """, (chat_id, timer, chat_id))
+            INSERT INTO settings(chat_id, timer_seconds) VALUES (?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET timer_seconds=excluded.timer_seconds
+        """, (chat_id, timer))
     if mafia is not None:
         cur.execute("""
-            UPDATE settings SET mafia_count=? WHERE chat_id=?
-        """, (mafia, chat_id))
+            INSERT INTO settings(chat_id, mafia_count) VALUES (?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET mafia_count=excluded.mafia_count
+        """, (chat_id, mafia))
 
 
 if __name__ == "__main__":
     # Удаляем старый файл базы данных
-    if DB_PATH.exists():
-        os.remove(DB_PATH)
+    close_pool()
+    for suffix in ("", "-wal", "-shm"):
+        path = Path(str(DB_PATH) + suffix)
+        if path.exists():
+            os.remove(path)
     init_db()
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""Журнал событий идущих партий для восстановления после перезапуска.
+
+У каждой идущей партии свой файл events/<chat_id>.log: по строке JSON на
+событие. События копятся в памяти и пишутся с fsync один раз за фазу.
+Когда партия заканчивается, файл удаляется, поэтому при старте читаются
+только журналы живых партий.
+
+События:
+    ["s", [[player_id, username, role], ...], game_id]   старт и раздача ролей
+    ["v", vote_type, target_id, voter_id]                принятый голос
+    ["r", night]                                          итог фазы (Game.resolve_phase)
+    ["t", deadline, night]                                следующая фаза и её дедлайн (time.time())
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+import log
+import metrics
+from game import Game
+
+BASE_DIR = Path(__file__).resolve().parent
+EVENTS_DIR = Path(os.getenv("EVENTS_DIR", BASE_DIR / "events"))
+
+
+class EventLog:
+    def __init__(self, directory=EVENTS_DIR):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._buffers = {}
+
+    def _path(self, chat_id: int) -> Path:
+        return self.directory / f"{chat_id}.log"
+
+    def append(self, chat_id: int, *event) -> None:
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._buffers.setdefault(chat_id, []).append(line)
+
+    def start(self, chat_id: int, players_roles, game_id: int = None) -> None:
+        with self._lock:
+            self._buffers[chat_id] = []
+            path = self._path(chat_id)
+            if path.exists():
+                path.unlink()
+        self.append(chat_id, "s", [list(row) for row in players_roles], game_id)
+
+    def flush(self, chat_id: int) -> None:
+        # Вызывается на границе фазы: одна запись и один fsync
+        with self._lock:
+            lines = self._buffers.pop(chat_id, None)
+        if not lines:
+            return
+        began = time.perf_counter()
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self._path(chat_id), "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        metrics.observe("eventlog_flush_seconds", time.perf_counter() - began)
+
+    def end(self, chat_id: int) -> None:
+        with self._lock:
+            self._buffers.pop(chat_id, None)
+            path = self._path(chat_id)
+            if path.exists():
+                path.unlink()
+
+    def recover(self) -> list:
+        # [(Game, deadline)] для всех партий, у которых остался журнал
+        if not self.directory.exists():
+            return []
+        recovered = []
+        for path in self.directory.glob("*.log"):
+            try:
+                game, deadline = replay(int(path.stem), path.read_text(encoding="utf-8").splitlines())
+            except Exception:
+                log.exception("eventlog", "replay failed", file=path.name)
+                continue
+            if game is not None:
+                recovered.append((game, deadline))
+        metrics.inc("eventlog_recovered_total", len(recovered))
+        return recovered
+
+
+def replay(chat_id: int, lines) -> tuple:
+    game = None
+    deadline = None
+    for line in lines:
+        if not line:
+            continue
+        try:
+            event = json.loads(line)
+        except ValueError:
+            # Недописанная строка в конце файла после падения
+            break
+        kind = event[0]
+        if kind == "s":
+            game = Game(chat_id)
+            game.load(tuple(row) for row in event[1])
+            game.game_id = event[2] if len(event) > 2 else None
+            game.active = True
+            game.night = False
+        elif game is None:
+            continue
+        elif kind == "v":
+            game.cast_vote(event[1], event[2], event[3])
+        elif kind == "r":
+            game.resolve_phase(event[1])
+        elif kind == "t":
+            deadline = event[1]
+            game.night = event[2]
+    return game, deadline
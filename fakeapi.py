@@ -0,0 +1,158 @@
+"""Локальная заглушка Telegram Bot API для нагрузочных тестов.
+
+Поддерживает getMe, getUpdates (long polling), sendMessage, sendPhoto,
+answerCallbackQuery, getChatMember и deleteWebhook/setWebhook. Настоящий
+bot.py подключается к ней через TELEGRAM_API_URL без изменений:
+
+    python fakeapi.py --port 8081
+    TELEGRAM_API_URL=http://127.0.0.1:8081 TOKEN=1:fake python bot.py
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Mafia", "username": "mafia_fake_bot"}
+
+
+class FakeBotApi:
+    def __init__(self):
+        self.updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_update = asyncio.Event()
+        # on_send(method, chat_id, payload) вызывается на каждый ответ бота
+        self.listeners = []
+        self.requests = {}
+        self.updates_delivered = 0
+
+    # --- что «присылают пользователи» ---
+
+    def push_update(self, **update) -> int:
+        update_id = next(self._update_ids)
+        self.updates.append({"update_id": update_id, **update})
+        self._new_update.set()
+        return update_id
+
+    def push_command(self, chat_id: int, user_id: int, first_name: str, text: str) -> int:
+        command = text.split()[0]
+        return self.push_update(message={
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+        })
+
+    def push_callback(self, callback_id: str, chat_id: int, user_id: int, first_name: str, data: str) -> int:
+        return self.push_update(callback_query={
+            "id": callback_id,
+            "from": {"id": user_id, "is_bot": False, "first_name": first_name},
+            "chat_instance": str(chat_id),
+            "message": {"message_id": next(self._message_ids), "date": int(time.time()),
+                        "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"}},
+            "data": data,
+        })
+
+    # --- Bot API ---
+
+    async def _params(self, request: web.Request) -> dict:
+        params = dict(request.query)
+        if request.can_read_body:
+            if request.content_type == "application/json":
+                params.update(await request.json())
+            elif request.content_type == "multipart/form-data":
+                # request.post() не читает тело GET-запросов, а AsyncTeleBot шлёт
+                # getUpdates и прочие методы именно GET с формой в теле
+                async for part in await request.multipart():
+                    params[part.name] = "<file>" if part.filename else await part.text()
+            else:
+                params.update(parse_qsl(await request.text()))
+        return params
+
+    def _message(self, chat_id, **fields) -> dict:
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"},
+                "from": BOT_USER, **fields}
+
+    def _notify(self, method: str, chat_id, params: dict) -> None:
+        for listener in self.listeners:
+            listener(method, chat_id, params)
+
+    async def get_updates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 30)
+        if offset:
+            self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        batch = self.updates[:limit]
+        self.updates_delivered += len(batch)
+        return batch
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = await self._params(request)
+        self.requests[method] = self.requests.get(method, 0) + 1
+
+        if method == "getUpdates":
+            result = await self.get_updates(params)
+        elif method == "getMe":
+            result = BOT_USER
+        elif method == "sendMessage":
+            chat_id = int(params["chat_id"])
+            markup = params.get("reply_markup")
+            if isinstance(markup, str):
+                markup = json.loads(markup)
+            result = self._message(chat_id, text=params.get("text", ""))
+            self._notify(method, chat_id, {**params, "reply_markup": markup})
+        elif method == "sendPhoto":
+            chat_id = int(params["chat_id"])
+            result = self._message(chat_id, photo=[{"file_id": "fake-photo", "file_unique_id": "fake",
+                                                    "width": 1, "height": 1}])
+            self._notify(method, chat_id, params)
+        elif method == "answerCallbackQuery":
+            result = True
+            self._notify(method, None, params)
+        elif method == "getChatMember":
+            result = {"status": "creator",
+                      "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "admin"}}
+        elif method in ("deleteWebhook", "setWebhook", "close", "logOut"):
+            result = True
+        else:
+            return web.json_response({"ok": False, "error_code": 404, "description": f"unknown method {method}"},
+                                     status=404)
+        return web.json_response({"ok": True, "result": result})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    web.run_app(FakeBotApi().app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
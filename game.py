@@ -0,0 +1,221 @@
+import threading
+from collections import Counter
+from queue import Queue
+
+import log
+import rules
+
+
+class Player:
+    __slots__ = ("player_id", "username", "role", "afk_count", "death_phase", "death_cause")
+
+    def __init__(self, player_id: int, username: str, role: str):
+        self.player_id = player_id
+        self.username = username
+        self.role = role
+        self.afk_count = 0
+        # Фаза и причина выбывания (rules.DEATH_CAUSES) для архива партий
+        self.death_phase = None
+        self.death_cause = None
+
+
+class Game:
+    """Состояние одной партии в чате.
+
+    Во время игры это единственный источник правды: голоса, смерти и АФК
+    живут только в памяти, в базу уходят лишь регистрации и итоги партии.
+    """
+
+    __slots__ = ("chat_id", "game_id", "active", "night", "timer", "lock", "players", "alive", "voted", "votes",
+                 "phase", "keyboards", "journal")
+
+    def __init__(self, chat_id: int):
+        self.chat_id = chat_id
+        # Время старта партии в мс: вместе с chat_id связывает записи лога и журнала
+        self.game_id = None
+        self.active = False
+        self.night = False
+        self.timer = None
+        self.lock = threading.RLock()
+        self.players = {}
+        self.alive = set()
+        self.voted = set()
+        self.votes = []
+        self.phase = 0
+        self.keyboards = {}
+        # journal(*event) пишет голоса и итоги фаз в журнал (eventlog) под той же блокировкой
+        self.journal = None
+
+    def load(self, players_roles) -> None:
+        with self.lock:
+            self.players = {pid: Player(pid, name, role) for pid, name, role in players_roles}
+            self.alive = set(self.players)
+            self.voted = set()
+            self.votes = []
+            self.phase = 0
+            self.keyboards = {}
+
+    def get_players_roles(self) -> list:
+        return [(p.player_id, p.username, p.role) for p in self.players.values()]
+
+    def get_all_alive(self) -> list:
+        return [p.username for p in self.players.values() if p.player_id in self.alive]
+
+    def get_mafia_usernames(self) -> str:
+        return "\n".join(p.username for p in self.players.values()
+                         if p.role == "mafia" and p.player_id in self.alive)
+
+    def vote_targets(self, vote_type: str) -> list:
+        # (player_id, имя) живых целей в порядке регистрации
+        excluded = vote_type if vote_type in rules.OWN_ROLE_EXCLUDED else None
+        return [(p.player_id, p.username) for p in self.players.values()
+                if p.player_id in self.alive and p.role != excluded]
+
+    def cast_button_vote(self, vote_type: str, game_id: int, phase: int, target_id: int,
+                         voted_id: int) -> Player | None:
+        # Голос с кнопки: возвращает игрока-цель или None. Кнопки прошлых фаз и
+        # прошлых партий чата (phase в каждой партии считается с нуля) не принимаем
+        with self.lock:
+            if not self.active or game_id != (self.game_id or 0) or phase != self.phase:
+                return None
+            return self.players[target_id] if self.cast_vote(vote_type, target_id, voted_id) else None
+
+    def usernames(self, player_ids) -> list:
+        return [self.players[pid].username for pid in player_ids]
+
+    def awaiting(self) -> int:
+        # Сколько живых игроков ещё должны походить в текущей фазе:
+        # днём голосуют все, ночью - только ночные роли
+        with self.lock:
+            return sum(1 for pid in self.alive if pid not in self.voted
+                       and (not self.night or self.players[pid].role in rules.NIGHT_ROLES))
+
+    def _kill(self, player_ids, cause: str) -> None:
+        for pid in player_ids:
+            self.alive.discard(pid)
+            player = self.players[pid]
+            player.death_phase = self.phase
+            player.death_cause = cause
+
+    def _count_alive(self, role_check) -> int:
+        return sum(1 for pid in self.alive if role_check(self.players[pid].role))
+
+    def cast_vote(self, vote_type: str, target_id: int, voted_id: int) -> bool:
+        with self.lock:
+            player = self.players.get(voted_id)
+            if player is None:
+                return False
+            if voted_id not in self.alive or voted_id in self.voted:
+                return False
+            if not rules.can_vote(vote_type, player.role):
+                return False
+            if target_id not in self.alive:
+                return False
+
+            self.votes.append((vote_type, target_id))
+            self.voted.add(voted_id)
+            if self.journal is not None:
+                self.journal("v", vote_type, target_id, voted_id)
+            return True
+
+    def cast_votes(self, votes) -> int:
+        # Пачка голосов [(vote_type, target_id, voted_id)] под одной блокировкой
+        with self.lock:
+            return sum(self.cast_vote(vote_type, target, voted_id) for vote_type, target, voted_id in votes)
+
+    def _targets(self, vote_type: str) -> list:
+        return [target for kind, target in self.votes if kind == vote_type]
+
+    def night_resolution(self) -> list:
+        with self.lock:
+            mafia_target = rules.top_target(self._targets("mafia"))
+            maniac_target = rules.top_target(self._targets("maniac"))
+            doctor_target = rules.top_target(self._targets("doctor"))
+
+            # id ботов начинаются с 0, поэтому сравниваем с None, а не по истинности
+            dead_list = []
+            for target in (mafia_target, maniac_target):
+                if target is not None and target != doctor_target and target not in dead_list:
+                    dead_list.append(target)
+
+            self._kill(dead_list, "killed")
+            return dead_list
+
+    def citizen_kill(self) -> list:
+        with self.lock:
+            rows = Counter(self._targets("citizen")).most_common(2)
+            if not rows:
+                return []
+
+            top = rows[0]
+            if len(rows) > 1 and rows[1][1] == top[1]:
+                return []
+
+            self._kill([top[0]], "voted")
+            return [top[0]]
+
+    def check_winner(self) -> str | None:
+        with self.lock:
+            mafia_alive = self._count_alive(lambda role: role == "mafia")
+            maniac_alive = self._count_alive(lambda role: role == "maniac")
+            citizen_alive = len(self.alive) - mafia_alive - maniac_alive
+            return rules.winner(mafia_alive, maniac_alive, citizen_alive)
+
+    def clear_round(self, night: bool = None) -> list:
+        with self.lock:
+            kicked_list = []
+            for p in self.players.values():
+                if p.player_id not in self.alive or p.player_id in self.voted:
+                    continue
+                if night and p.role == "citizen":
+                    continue
+                p.afk_count += 1
+                if p.afk_count >= 2:
+                    kicked_list.append(p.player_id)
+
+            self._kill(kicked_list, "kicked")
+
+            self.voted = set()
+            self.votes = []
+            return kicked_list
+
+    def resolve_phase(self, night: bool) -> rules.PhaseResult:
+        # Итог фазы целиком: убитые, выгнанные за АФК, победитель и кто остался.
+        # Считаем по player_id, имена подставляем только для сообщений
+        with self.lock:
+            killed = self.night_resolution() if night else self.citizen_kill()
+            kicked = self.clear_round(night=night)
+            self.phase += 1
+            self.keyboards = {}
+            if self.journal is not None:
+                self.journal("r", night)
+            return rules.PhaseResult(self.usernames(killed), self.usernames(kicked), self.check_winner(),
+                                     self.get_all_alive())
+
+
+class Writer:
+    """Фоновая запись в базу: вызовы db.* выполняются по очереди в отдельном потоке."""
+
+    def __init__(self):
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            func, args, kwargs = self._queue.get()
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                log.exception("writer", "task failed", func=func.__name__)
+            finally:
+                self._queue.task_done()
+
+    def submit(self, func, *args, **kwargs) -> None:
+        self._queue.put((func, args, kwargs))
+
+    def flush(self) -> None:
+        self._queue.join()
+
+
+writer = Writer()
@@ -0,0 +1,104 @@
+"""Архив сыгранных партий и аналитика по нему.
+
+Каждая партия - одна строка таблицы games: победитель, длина в фазах,
+число игроков каждой роли, выгнанные за АФК и упакованный состав (roster)
+по 12 байт на игрока: player_id, роль, победил ли, фаза и причина
+выбывания. Агрегаты считает SQLite одним запросом по колонкам, без разбора
+составов в Python, так что отчёт по миллионам партий - один проход по таблице.
+
+    python history.py                # по всем чатам
+    python history.py --chat -100123
+"""
+import argparse
+import struct
+import time
+
+import db
+import rules
+
+ROSTER = struct.Struct("<qBBBB")
+ALIVE = 0xFF
+
+
+def record(game, winner: str) -> tuple:
+    # Строка архива для db.finish_game
+    roster = bytearray()
+    roles = dict.fromkeys(rules.ROLES, 0)
+    kicked = bots = 0
+    for p in game.players.values():
+        roles[p.role] = roles.get(p.role, 0) + 1
+        bots += p.player_id < rules.BOT_IDS
+        kicked += p.death_cause == "kicked"
+        roster += ROSTER.pack(
+            p.player_id,
+            rules.ROLES.index(p.role),
+            rules.faction(p.role) == winner,
+            ALIVE if p.death_phase is None else min(p.death_phase, ALIVE - 1),
+            0 if p.death_cause is None else rules.DEATH_CAUSES.index(p.death_cause) + 1,
+        )
+    # game_id - время старта в мс, в архиве оба времени в секундах
+    started = None if game.game_id is None else game.game_id // 1000
+    return (game.chat_id, started, int(time.time()), rules.WINNERS.index(winner), game.phase,
+            len(game.players), bots, kicked, *(roles[role] for role in rules.ROLES), bytes(roster))
+
+
+def unpack(roster: bytes) -> list:
+    # [(player_id, роль, победил, фаза выбывания или None, причина или None)]
+    return [
+        (pid, rules.ROLES[role], bool(won), None if phase == ALIVE else phase,
+         rules.DEATH_CAUSES[cause - 1] if cause else None)
+        for pid, role, won, phase, cause in ROSTER.iter_unpack(roster)
+    ]
+
+
+def summary(chat_id: int = None) -> dict:
+    games, avg_phases, kicked, players, *wins = db.get_history_summary(chat_id) or (0, None, 0, 0)
+    return {
+        "games": games,
+        "avg_phases": avg_phases or 0.0,
+        "afk_kick_rate": kicked / players if players else 0.0,
+        "wins": {faction: int(n) for faction, n in zip(rules.WINNERS, wins)},
+    }
+
+
+def role_win_rates(chat_id: int = None) -> dict:
+    # {роль: (сыграно, побед, доля побед)}
+    return {role: (played, wins, wins / played if played else 0.0)
+            for role, played, wins in db.get_role_win_rates(chat_id) or []}
+
+
+def mafia_balance(chat_id: int = None) -> list:
+    # [(мафий, партий, средняя длина, {фракция: доля побед})] - для подбора /config
+    return [
+        (mafia, games, avg_phases, {faction: n / games for faction, n in zip(rules.WINNERS, wins)})
+        for mafia, games, avg_phases, *wins in db.get_mafia_balance(chat_id) or []
+    ]
+
+
+def report(chat_id: int = None) -> str:
+    total = summary(chat_id)
+    lines = [
+        f"Партий: {total['games']}, средняя длина: {total['avg_phases']:.1f} фаз, "
+        f"выгнано за АФК: {total['afk_kick_rate']:.1%}",
+        "Победы: " + ", ".join(f"{faction} {n}" for faction, n in total["wins"].items()),
+        "По ролям:",
+    ]
+    for role, (played, wins, rate) in role_win_rates(chat_id).items():
+        lines.append(f"  {role}: {played} игр, {wins} побед ({rate:.1%})")
+    lines.append("По числу мафий:")
+    for mafia, games, avg_phases, rates in mafia_balance(chat_id):
+        shares = ", ".join(f"{faction} {rate:.0%}" for faction, rate in rates.items())
+        lines.append(f"  {mafia}: {games} партий, {avg_phases:.1f} фаз, {shares}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chat", type=int)
+    args = parser.parse_args(argv)
+    db.init_db()
+    print(report(args.chat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Рейтинги игроков: общий, по чату и по роли.
+
+Данные обновляются в db.finish_game, а готовый текст /stats кешируется
+до конца следующей партии, так что повторные /stats не трогают базу.
+При шардировании общий и ролевой рейтинги собираются со всех шардов, а
+партии других процессов кеш не сбрасывают, поэтому они живут MERGED_TTL секунд.
+"""
+import threading
+import time
+
+import db
+import rules
+
+MERGED_TTL = 30.0
+
+_lock = threading.Lock()
+_cache = {}
+_generation = 0
+
+
+def render(view: str = "global", key=None) -> str:
+    cache_key = (view, key)
+    now = time.monotonic()
+    with _lock:
+        text, expires = _cache.get(cache_key, (None, None))
+        generation = _generation
+    if text is not None and (expires is None or now < expires):
+        return text
+
+    merged = bool(db.SHARDS) and view != "chat"
+    if view == "chat":
+        text = _format("Топ игроков чата:", db.get_chat_stats(key))
+    elif view == "role":
+        rows = db.get_merged_role_stats(key) if merged else db.get_role_stats(key)
+        text = _format(f"Топ игроков за роль {key}:", rows, win_rate=True)
+    else:
+        text = _format("Топ игроков:", db.get_merged_stats() if merged else db.get_stats())
+
+    with _lock:
+        # Если пока читали базу, рейтинг успел измениться, не кешируем старый текст
+        if generation == _generation:
+            _cache[cache_key] = (text, now + MERGED_TTL if merged else None)
+    return text
+
+
+def _format(title: str, rows, win_rate: bool = False) -> str:
+    text = title + "\n"
+    for name, games_cnt, wins in rows or []:
+        text += f"{name}: Игр: {games_cnt}, Побед: {wins}"
+        if win_rate and games_cnt:
+            text += f" ({wins * 100 // games_cnt}%)"
+        text += "\n"
+    return text
+
+
+def invalidate(chat_id: int = None, roles=rules.ROLES) -> None:
+    global _generation
+    with _lock:
+        _generation += 1
+        _cache.pop(("global", None), None)
+        if chat_id is not None:
+            _cache.pop(("chat", chat_id), None)
+        for role in roles:
+            _cache.pop(("role", role), None)
+
+
+def finish_game(chat_id: int, winner: str, roles=rules.ROLES, archive: tuple = None) -> None:
+    # Записываем итоги партии (и строку архива) и сбрасываем затронутые рейтинги
+    db.finish_game(chat_id, winner, archive)
+    invalidate(chat_id, roles)
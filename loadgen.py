@@ -0,0 +1,242 @@
+"""Сквозной нагрузочный прогон настоящего бота против заглушки Bot API.
+
+Поднимает fakeapi.FakeBotApi в этом процессе, запускает bot.py (или
+aiobot.py) отдельным процессом с TELEGRAM_API_URL на заглушку и гоняет
+через него синтетические группы: /config, /reg, /game и нажатия кнопок
+голосования из присланных клавиатур. Партии перезапускаются, пока не
+наберётся --games или не выйдет --duration.
+
+Меряется:
+    latency   от появления апдейта до ответа бота (answerCallbackQuery для
+              кнопок, ответ на саму команду - по его тексту, см. REPLIES)
+    polling   апдейтов в секунду, забранных через getUpdates
+    peak      максимум одновременно идущих партий
+
+    python loadgen.py --groups 1000 --games 3000
+    python loadgen.py --runtime async --groups 200 --duration 60
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import deque
+
+from fakeapi import FakeBotApi
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RUNTIMES = {"sync": "bot.py", "async": "aiobot.py", "sharded": "shards.py"}
+# Ответы бота на команды. Outbox склеивает подряд идущие сообщения чата,
+# поэтому ответ ищется в тексте, а не берётся первое сообщение после команды
+REPLIES = {
+    "/config": ("Настройки обновлены", "Использование: /config"),
+    "/reg": ("Вы в игре!", "Нельзя зарегистрироваться"),
+    "/game": ("Игра началась", "Игра уже идет", "Только админ может запустить", "Не удалось начать игру"),
+}
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+class LoadGenerator:
+    def __init__(self, api: FakeBotApi, groups: int, humans: int, games: int, timer: int,
+                 click_rate: float, ramp: float, seed: int):
+        self.api = api
+        self.groups = [-2_000_000 - n for n in range(groups)]
+        self.members = {chat_id: [30_000 + n * 100 + i for i in range(humans)]
+                        for n, chat_id in enumerate(self.groups)}
+        self.user_chat = {user_id: chat_id for chat_id, users in self.members.items() for user_id in users}
+        self.target_games = games
+        self.timer = timer
+        self.click_rate = click_rate
+        self.ramp = ramp
+        self.rng = random.Random(seed)
+        self.loop = None
+        self.done = None
+
+        self._callback_ids = itertools.count(1)
+        self.pending_commands = {}
+        self.pending_callbacks = {}
+        self.latency = {"command": [], "callback": []}
+        self.started = 0
+        self.finished = 0
+        self.active = set()
+        self.peak = 0
+        self.messages = 0
+
+        api.listeners.append(self.on_send)
+
+    # --- пользователи ---
+
+    def command(self, chat_id: int, user_id: int, text: str) -> None:
+        pending = self.pending_commands.setdefault(chat_id, {})
+        pending.setdefault(text.split()[0], deque()).append(time.perf_counter())
+        self.api.push_command(chat_id, user_id, f"user{user_id}", text)
+
+    def click(self, user_id: int, markup: dict) -> None:
+        buttons = [row[0] for row in markup["inline_keyboard"]]
+        if not buttons or self.rng.random() >= self.click_rate:
+            return
+        callback_id = str(next(self._callback_ids))
+        self.pending_callbacks[callback_id] = time.perf_counter()
+        self.api.push_callback(callback_id, self.user_chat.get(user_id, user_id), user_id, f"user{user_id}",
+                               self.rng.choice(buttons)["callback_data"])
+
+    def later(self, delay: float, func, *args) -> None:
+        self.loop.call_later(delay, func, *args)
+
+    def open_lobby(self, chat_id: int) -> None:
+        admin = self.members[chat_id][0] if self.members[chat_id] else 1
+        self.command(chat_id, admin, f"/config {self.timer}")
+        for user_id in self.members[chat_id]:
+            self.command(chat_id, user_id, "/reg")
+        self.start_game(chat_id)
+
+    def start_game(self, chat_id: int) -> None:
+        if self.started >= self.target_games:
+            return
+        self.started += 1
+        admin = self.members[chat_id][0] if self.members[chat_id] else 1
+        self.command(chat_id, admin, "/game")
+
+    # --- ответы бота ---
+
+    def on_send(self, method: str, chat_id, params: dict) -> None:
+        now = time.perf_counter()
+        if method == "answerCallbackQuery":
+            began = self.pending_callbacks.pop(params.get("callback_query_id"), None)
+            if began is not None:
+                self.latency["callback"].append(now - began)
+            return
+
+        self.messages += 1
+        text = params.get("text") or ""
+        for command, waiting in self.pending_commands.get(chat_id, {}).items():
+            # В склеенном сообщении может быть несколько ответов на одну команду
+            for _ in range(min(len(waiting), sum(text.count(reply) for reply in REPLIES[command]))):
+                self.latency["command"].append(now - waiting.popleft())
+
+        if "Игра началась" in text:
+            self.active.add(chat_id)
+            self.peak = max(self.peak, len(self.active))
+        elif ("Игра окончена" in text or "Игра остановлена" in text) and chat_id in self.active:
+            self.active.discard(chat_id)
+            self.finished += 1
+            if self.finished >= self.target_games:
+                self.done.set()
+            else:
+                self.later(self.rng.uniform(0.5, 1.5), self.start_game, chat_id)
+
+        markup = params.get("reply_markup")
+        if markup and "inline_keyboard" in markup:
+            # В группе голосуют все её участники, в личке - получатель
+            voters = self.members.get(chat_id, [chat_id])
+            for user_id in voters:
+                self.later(self.rng.uniform(0.1, self.timer * 0.8), self.click, user_id, markup)
+
+    async def run(self, duration: float) -> float:
+        self.loop = asyncio.get_running_loop()
+        self.done = asyncio.Event()
+        for chat_id in self.groups:
+            self.later(self.rng.uniform(0, self.ramp), self.open_lobby, chat_id)
+        began = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.done.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+        return time.perf_counter() - began
+
+
+def bot_process(runtime: str, port: int, workdir: str, metrics_dump: str) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "TOKEN": "1:loadgen",
+        "TELEGRAM_API_URL": f"http://127.0.0.1:{port}",
+        "DB_PATH": os.path.join(workdir, "load.db"),
+        "EVENTS_DIR": os.path.join(workdir, "events"),
+        "SHARD_DIR": os.path.join(workdir, "shards"),
+        "BOT_MODE": "polling",
+        "METRICS_DUMP": metrics_dump,
+        "METRICS_INTERVAL": "1",
+        # Лимиты Telegram заглушке не нужны: меряем сам бот
+        "OUTBOX_GLOBAL_RATE": "100000",
+        "OUTBOX_GROUP_RATE": "100000",
+        "OUTBOX_GROUP_BURST": "100000",
+        "OUTBOX_PRIVATE_RATE": "100000",
+        "OUTBOX_PRIVATE_BURST": "100000",
+    })
+    return subprocess.Popen([sys.executable, os.path.join(BASE_DIR, RUNTIMES[runtime])], env=env,
+                            cwd=workdir, stdout=subprocess.DEVNULL, stderr=open(os.path.join(workdir, "bot.err"), "w"))
+
+
+async def main_async(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="mafia-load-")
+    metrics_dump = os.path.join(workdir, "metrics.json")
+    api = FakeBotApi()
+    runner = await api.start(port=args.port)
+    process = bot_process(args.runtime, args.port, workdir, metrics_dump)
+    try:
+        generator = LoadGenerator(api, args.groups, args.humans, args.games, args.timer,
+                                  args.click_rate, args.ramp, args.seed)
+        elapsed = await generator.run(args.duration)
+        await asyncio.sleep(1.5)
+    finally:
+        process.terminate()
+        process.wait()
+        await runner.cleanup()
+
+    result = {
+        "games": generator.finished,
+        "games_started": generator.started,
+        "peak_concurrent": generator.peak,
+        "elapsed_sec": elapsed,
+        "updates_per_sec": api.updates_delivered / elapsed if elapsed else 0.0,
+        "get_updates_calls": api.requests.get("getUpdates", 0),
+        "messages": generator.messages,
+        "command_p50_ms": percentile(generator.latency["command"], 0.50) * 1000,
+        "command_p99_ms": percentile(generator.latency["command"], 0.99) * 1000,
+        "callback_p50_ms": percentile(generator.latency["callback"], 0.50) * 1000,
+        "callback_p99_ms": percentile(generator.latency["callback"], 0.99) * 1000,
+        "unanswered_callbacks": len(generator.pending_callbacks),
+        "unanswered_commands": sum(len(waiting) for pending in generator.pending_commands.values()
+                                   for waiting in pending.values()),
+    }
+    if os.path.exists(metrics_dump):
+        with open(metrics_dump) as f:
+            lag = json.load(f)["histograms"].get("scheduler_lag_seconds")
+        if lag:
+            result["scheduler_lag_p99_ms"] = lag["p99"] * 1000
+    result["workdir"] = workdir
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runtime", choices=sorted(RUNTIMES), default="sync")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--humans", type=int, default=3)
+    parser.add_argument("--games", type=int, default=300)
+    parser.add_argument("--timer", type=int, default=3, help="длительность фазы, /config")
+    parser.add_argument("--click-rate", type=float, default=0.9)
+    parser.add_argument("--ramp", type=float, default=5.0, help="за сколько секунд открываются все лобби")
+    parser.add_argument("--duration", type=float, default=300.0)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(main_async(args))
+    for key, value in result.items():
+        print(f"  {key:22} {value:.2f}" if isinstance(value, float) else f"  {key:22} {value}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
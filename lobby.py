@@ -0,0 +1,36 @@
+"""Лобби: регистрации до старта партии.
+
+/reg только запоминает игрока в памяти, в базу лобби попадает на /game
+одной транзакцией вместе с ботами-заполнителями и раздачей ролей
+(db.start_game). Регистрации, не дожившие до /game, при перезапуске бота
+теряются - игрокам достаточно повторить /reg.
+"""
+import threading
+from random import sample
+
+import db
+import rules
+
+BOT_NAMES = ["Вася", "Петя", "Коля", "Света", "Оля", "Катя", "Дима", "Саша", "Лена", "Маша"]
+
+_lock = threading.Lock()
+# chat_id -> {player_id: username}
+_pending = {}
+
+
+def register(chat_id: int, player_id: int, username: str) -> None:
+    with _lock:
+        _pending.setdefault(chat_id, {})[player_id] = username
+
+
+def start(chat_id: int, mafia_count: int = None) -> tuple | None:
+    # ([(player_id, username, role)], добавлены ли боты) или None, если запись не удалась
+    with _lock:
+        registrations = _pending.pop(chat_id, {})
+    result = db.start_game(chat_id, list(registrations.items()), sample(BOT_NAMES, rules.BOT_IDS), mafia_count)
+    if result is None and registrations:
+        # Транзакция откатилась - возвращаем регистрации, более поздние /reg главнее
+        with _lock:
+            registrations.update(_pending.get(chat_id, {}))
+            _pending[chat_id] = registrations
+    return result
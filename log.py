@@ -0,0 +1,126 @@
+"""Структурированный лог без блокировок на горячих путях.
+
+Записи - JSON по строке на событие - кладутся в очередь, в stdout (или
+LOG_FILE) их пишет фоновый поток пачками. Если очередь переполнена, запись
+отбрасывается и считается в log_dropped_total, игровые потоки никогда не
+ждут вывода.
+
+    LOG_LEVEL=debug                  # debug, info, warning, error; по умолчанию info
+    LOG_SAMPLE=vote=0.1,bot=0.01     # доля сохраняемых записей по категориям
+
+Сэмплирование касается только debug и info: предупреждения и ошибки пишутся
+всегда. Поля chat_id и game_id связывают записи одной партии.
+"""
+import atexit
+import json
+import os
+import random
+import sys
+import threading
+import time
+from queue import Empty, Full, Queue
+from traceback import format_exc, format_exception
+
+import metrics
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LEVELS = {"debug": DEBUG, "info": INFO, "warning": WARNING, "error": ERROR}
+NAMES = {value: name for name, value in LEVELS.items()}
+
+LEVEL = LEVELS[os.getenv("LOG_LEVEL", "info").lower()]
+SAMPLE = {
+    category: float(rate)
+    for category, rate in (item.split("=") for item in os.getenv("LOG_SAMPLE", "").split(",") if item)
+}
+QUEUE_SIZE = 10000
+BATCH = 256
+
+# Своя последовательность: сэмплирование не сдвигает глобальный random
+_rng = random.Random()
+
+
+class Writer:
+    def __init__(self, stream=None):
+        self.stream = stream
+        self._queue = Queue(maxsize=QUEUE_SIZE)
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, record: dict) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            metrics.inc("log_dropped_total", category=record["cat"])
+
+    def _run(self):
+        while True:
+            records = [self._queue.get()]
+            while len(records) < BATCH:
+                try:
+                    records.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            stream = self.stream or sys.stdout
+            try:
+                stream.write("".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in records))
+                stream.flush()
+            except Exception:
+                pass
+            finally:
+                for _ in records:
+                    self._queue.task_done()
+
+    def flush(self) -> None:
+        self._queue.join()
+
+
+_stream = open(os.environ["LOG_FILE"], "a", encoding="utf-8") if os.getenv("LOG_FILE") else None
+writer = Writer(_stream)
+atexit.register(writer.flush)
+
+
+def enabled(level: int) -> bool:
+    # Проверка до сборки полей: выключенный debug ничего не стоит
+    return level >= LEVEL
+
+
+def emit(level: int, category: str, message: str, exc=False, **fields) -> None:
+    if level < LEVEL:
+        return
+    if level < WARNING:
+        rate = SAMPLE.get(category, 1.0)
+        if rate < 1.0 and _rng.random() >= rate:
+            return
+    record = {"ts": round(time.time(), 3), "level": NAMES[level], "cat": category, "msg": message}
+    record.update(fields)
+    if exc is True:
+        record["exc"] = format_exc()
+    elif exc:
+        record["exc"] = "".join(format_exception(exc))
+    writer.put(record)
+
+
+def debug(category: str, message: str, **fields) -> None:
+    emit(DEBUG, category, message, **fields)
+
+
+def info(category: str, message: str, **fields) -> None:
+    emit(INFO, category, message, **fields)
+
+
+def warning(category: str, message: str, **fields) -> None:
+    emit(WARNING, category, message, **fields)
+
+
+def error(category: str, message: str, **fields) -> None:
+    emit(ERROR, category, message, **fields)
+
+
+def exception(category: str, message: str, exc: BaseException = None, **fields) -> None:
+    # Вызывать из except: трассировка форматируется в текущем потоке.
+    # Вне except (колбэк Future) исключение передаётся явно в exc
+    emit(ERROR, category, message, exc=exc or True, **fields)
+
+
+def flush() -> None:
+    writer.flush()
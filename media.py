@@ -0,0 +1,52 @@
+"""Отправка картинок по file_id.
+
+Файл загружается в Telegram один раз, полученный file_id хранится в таблице
+media и дальше картинка отправляется по нему. Если Telegram отверг file_id,
+файл загружается заново.
+"""
+import os
+import threading
+
+import db
+import metrics
+from outbox import resolve
+
+_lock = threading.Lock()
+_file_ids = {}
+
+
+def _file_id(name: str) -> str | None:
+    with _lock:
+        if name in _file_ids:
+            return _file_ids[name]
+    file_id = db.get_media_id(name)
+    with _lock:
+        _file_ids[name] = file_id
+    return file_id
+
+
+def _remember(name: str, file_id: str | None) -> None:
+    with _lock:
+        _file_ids[name] = file_id
+    db.set_media_id(name, file_id)
+
+
+def send_photo(client, chat_id, path: str):
+    name = os.path.basename(path)
+    file_id = _file_id(name)
+    if file_id:
+        try:
+            return resolve(client.send_photo(chat_id, file_id))
+        except Exception as exc:
+            # 400 - file_id устарел или чужой, остальные ошибки отдаём outbox
+            if getattr(exc, "error_code", None) != 400:
+                raise
+            metrics.inc("media_rejected_total")
+            _remember(name, None)
+
+    with open(path, 'rb') as photo:
+        message = resolve(client.send_photo(chat_id, photo))
+    metrics.inc("media_uploads_total")
+    if message is not None and getattr(message, "photo", None):
+        _remember(name, message.photo[-1].file_id)
+    return message
@@ -0,0 +1,201 @@
+"""Лёгкие метрики процесса: счётчики, текущие значения и гистограммы задержек.
+
+Отдаются в текстовом формате Prometheus (serve) и периодическим снимком
+в JSON (dump_periodically). METRICS=0 отключает сбор.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ENABLED = os.getenv("METRICS", "1") != "0"
+
+# Границы корзин гистограмм задержек, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Оценка по верхней границе корзины
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank and n:
+                return bound
+        return 0.0
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not ENABLED:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge(self, name: str, value: float, **labels) -> None:
+        # Текущее значение; нулевые серии удаляются, чтобы метки по чатам не копились
+        if not ENABLED:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if value:
+                self.gauges[key] = value
+            else:
+                self.gauges.pop(key, None)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not ENABLED:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def value(self, name: str, **labels) -> float:
+        with self._lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def total(self, name: str) -> float:
+        # Сумма счётчика по всем меткам
+        with self._lock:
+            return sum(v for (n, _), v in self.counters.items() if n == name)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{_labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f"{name}{_labels(labels)} {value}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                seen = 0
+                for bound, n in zip(BUCKETS, hist.counts):
+                    seen += n
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {seen}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {hist.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {hist.total}")
+                lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "time": time.time(),
+                "counters": {name + _labels(labels): value for (name, labels), value in self.counters.items()},
+                "gauges": {name + _labels(labels): value for (name, labels), value in self.gauges.items()},
+                "histograms": {
+                    name + _labels(labels): {"count": h.count, "sum": h.total,
+                                             "p50": h.quantile(0.5), "p99": h.quantile(0.99)}
+                    for (name, labels), h in self.histograms.items()
+                },
+            }
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+registry = Registry()
+inc = registry.inc
+gauge = registry.gauge
+observe = registry.observe
+
+
+@contextmanager
+def timer(name: str, **labels):
+    began = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - began, **labels)
+
+
+def timed(name: str):
+    # Декоратор: число вызовов и гистограмма задержек с меткой func
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            began = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - began, func=func.__name__)
+        return wrapper
+    return decorator
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def dump_periodically(path: str, interval: float = 60.0) -> threading.Thread:
+    def run():
+        while True:
+            time.sleep(interval)
+            tmp = path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(registry.snapshot(), f, ensure_ascii=False)
+            os.replace(tmp, path)
+
+    thread = threading.Thread(target=run, name="metrics-dump", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_from_env() -> None:
+    # METRICS_PORT - HTTP /metrics, METRICS_DUMP - файл снимка (раз в METRICS_INTERVAL сек)
+    if not ENABLED:
+        return
+    if os.getenv("METRICS_PORT"):
+        serve(int(os.getenv("METRICS_PORT")))
+    if os.getenv("METRICS_DUMP"):
+        dump_periodically(os.getenv("METRICS_DUMP"), float(os.getenv("METRICS_INTERVAL", "60")))
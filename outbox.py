@@ -0,0 +1,277 @@
+import heapq
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError, Future
+
+import log
+import metrics
+
+# Лимиты Bot API: ~30 сообщений в секунду всего, 20 в минуту в группу
+# и около одного в секунду в личный чат. Переопределяются через окружение
+# для нагрузочных прогонов против локальной заглушки (loadgen.py)
+GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", 30))
+GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", 20 / 60))
+GROUP_BURST = float(os.getenv("OUTBOX_GROUP_BURST", 5))
+PRIVATE_RATE = float(os.getenv("OUTBOX_PRIVATE_RATE", 1))
+PRIVATE_BURST = float(os.getenv("OUTBOX_PRIVATE_BURST", 3))
+
+MAX_TEXT = 4096
+MAX_RETRIES = 5
+# Как часто выбрасывать вёдра простаивающих чатов
+PRUNE_INTERVAL = 60.0
+# Потоки нужны только синхронному клиенту: запрос асинхронного (Future)
+# завершается колбэком и поток не держит
+WORKERS = int(os.getenv("OUTBOX_WORKERS", 4))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "stamp")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = now
+
+    def wait_time(self, now: float) -> float:
+        # Сколько ждать до следующего токена (0 - можно отправлять)
+        self.tokens = min(self.capacity, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def full(self, now: float) -> bool:
+        return self.tokens + (now - self.stamp) * self.rate >= self.capacity
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float, now: float) -> None:
+        # После 429 опустошаем ведро так, чтобы первый токен появился через seconds
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+        self.stamp = now
+
+
+class Item:
+    __slots__ = ("chat_id", "text", "kwargs", "call", "on_error", "retries")
+
+    def __init__(self, chat_id, text=None, kwargs=None, call=None, on_error=None):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs or {}
+        self.call = call
+        self.on_error = on_error
+        self.retries = 0
+
+    def mergeable(self) -> bool:
+        return self.call is None and not self.kwargs and self.on_error is None
+
+
+def resolve(result):
+    # Асинхронный рантайм возвращает Future вместо результата запроса
+    if isinstance(result, Future):
+        return result.result()
+    return result
+
+
+def retry_after(exc: Exception) -> float | None:
+    if getattr(exc, "error_code", None) != 429:
+        return None
+    parameters = (getattr(exc, "result_json", None) or {}).get("parameters") or {}
+    return float(parameters.get("retry_after", 1))
+
+
+class Outbox:
+    """Очередь исходящих сообщений с ограничением скорости.
+
+    Игровая логика ставит сообщения в очередь и не ждёт сети. Сообщения в
+    один чат уходят по порядку, подряд идущие простые тексты склеиваются в
+    одно сообщение. Ответ 429 откладывает чат на retry_after секунд.
+
+    Если клиент возвращает Future (aiobot.AsyncBridge), ответ обрабатывается
+    в колбэке - on_error тогда вызывается в потоке event loop и не должен
+    ждать других запросов к клиенту.
+    """
+
+    def __init__(self, get_client, workers: int = WORKERS, clock=time.monotonic):
+        self.get_client = get_client
+        self.clock = clock
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._buckets = {}
+        self._pruned = clock()
+        self._ready = []
+        self._busy = set()
+        self._pending = 0
+        self._global = TokenBucket(GLOBAL_RATE, GLOBAL_RATE, clock())
+
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+
+        for i in range(workers):
+            threading.Thread(target=self._run, name=f"outbox-{i}", daemon=True).start()
+
+    def send_message(self, chat_id, text: str, on_error=None, **kwargs) -> None:
+        self._put(Item(chat_id, text, kwargs, on_error=on_error))
+
+    def call(self, chat_id, func, on_error=None) -> None:
+        # Произвольный запрос к API в общей очереди чата: func(client)
+        self._put(Item(chat_id, call=func, on_error=on_error))
+
+    def flush(self, timeout: float = None) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {"queued": self._pending, "sent": self.sent, "merged": self.merged,
+                    "retried": self.retried, "failed": self.failed}
+
+    def _bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if chat_id < 0:
+                bucket = TokenBucket(GROUP_RATE, GROUP_BURST, now)
+            else:
+                bucket = TokenBucket(PRIVATE_RATE, PRIVATE_BURST, now)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _put(self, item: Item) -> None:
+        with self._cond:
+            queue = self._queues.get(item.chat_id)
+            if queue is None:
+                queue = self._queues[item.chat_id] = deque()
+            queue.append(item)
+            self._pending += 1
+            if len(queue) == 1 and item.chat_id not in self._busy:
+                heapq.heappush(self._ready, (self.clock(), item.chat_id))
+                self._cond.notify()
+
+    def _take(self):
+        # Берём чат, у которого есть сообщения и доступны токены
+        with self._cond:
+            while True:
+                now = self.clock()
+                if self._ready and self._ready[0][0] <= now:
+                    _, chat_id = heapq.heappop(self._ready)
+                    wait = max(self._bucket(chat_id, now).wait_time(now), self._global.wait_time(now))
+                    if wait > 0:
+                        heapq.heappush(self._ready, (now + wait, chat_id))
+                        continue
+                    self._bucket(chat_id, now).take()
+                    self._global.take()
+                    self._busy.add(chat_id)
+                    return chat_id, self._batch(self._queues[chat_id])
+                self._cond.wait(self._ready[0][0] - now if self._ready else None)
+
+    def _batch(self, queue: deque) -> list:
+        items = [queue.popleft()]
+        if not items[0].mergeable():
+            return items
+        size = len(items[0].text)
+        while queue and queue[0].call is None and queue[0].on_error is None \
+                and size + 1 + len(queue[0].text) <= MAX_TEXT:
+            size += 1 + len(queue[0].text)
+            items.append(queue.popleft())
+            # Сообщение с клавиатурой забирает предыдущие тексты и завершает пачку
+            if items[-1].kwargs:
+                break
+        return items
+
+    def _release(self, chat_id, done: int, requeue: list = None, delay: float = 0.0) -> None:
+        with self._cond:
+            self._busy.discard(chat_id)
+            queue = self._queues[chat_id]
+            if requeue:
+                queue.extendleft(reversed(requeue))
+            self._pending -= done
+            if queue:
+                heapq.heappush(self._ready, (self.clock() + delay, chat_id))
+            else:
+                del self._queues[chat_id]
+                self._prune()
+            self._cond.notify_all()
+
+    def _prune(self) -> None:
+        # Полное ведро чата без очереди ничем не отличается от нового - выбрасываем.
+        # Сразу после отправки ведро не полное, поэтому проверяем все разом и изредка
+        now = self.clock()
+        if now - self._pruned < PRUNE_INTERVAL:
+            return
+        self._pruned = now
+        for chat_id in [chat_id for chat_id, bucket in self._buckets.items()
+                        if chat_id not in self._queues and bucket.full(now)]:
+            del self._buckets[chat_id]
+
+    def _send(self, items: list):
+        # Результат запроса или Future асинхронного клиента
+        client = self.get_client()
+        first = items[0]
+        if first.call is not None:
+            return first.call(client)
+        text = "\n".join(item.text for item in items)
+        return client.send_message(first.chat_id, text, **items[-1].kwargs)
+
+    def _run(self):
+        while True:
+            chat_id, items = self._take()
+            began = time.perf_counter()
+            try:
+                result = self._send(items)
+            except Exception as exc:
+                self._complete(chat_id, items, began, exc)
+                continue
+            if isinstance(result, Future):
+                # Чат остаётся занятым до ответа, поток берёт следующий чат
+                result.add_done_callback(lambda future, chat_id=chat_id, items=items, began=began:
+                                         self._complete(chat_id, items, began, _error(future)))
+            else:
+                self._complete(chat_id, items, began, None)
+
+    def _complete(self, chat_id, items: list, began: float, exc: Exception | None) -> None:
+        metrics.observe("outbox_send_seconds", time.perf_counter() - began)
+        if exc is None:
+            metrics.inc("outbox_sent_total")
+            metrics.inc("outbox_merged_total", len(items) - 1)
+            with self._cond:
+                self.sent += 1
+                self.merged += len(items) - 1
+            self._release(chat_id, len(items))
+            return
+
+        delay = retry_after(exc)
+        if delay is not None and items[0].retries < MAX_RETRIES:
+            for item in items:
+                item.retries += 1
+            metrics.inc("outbox_retries_total")
+            with self._cond:
+                self.retried += 1
+                self._bucket(chat_id, self.clock()).pause(delay, self.clock())
+            self._release(chat_id, 0, requeue=items, delay=delay)
+            return
+
+        metrics.inc("outbox_failures_total")
+        with self._cond:
+            self.failed += 1
+        if all(item.on_error is None for item in items):
+            log.exception("outbox", "send failed", exc=exc, chat_id=chat_id)
+        for item in items:
+            if item.on_error is None:
+                continue
+            try:
+                item.on_error(exc)
+            except Exception:
+                log.exception("outbox", "on_error failed", chat_id=chat_id)
+        self._release(chat_id, len(items))
+
+
+def _error(future: Future) -> Exception | None:
+    if future.cancelled():
+        return CancelledError()
+    return future.exception()
@@ -0,0 +1,79 @@
+import random
+from collections import Counter
+from typing import NamedTuple
+
+
+ROLES = ("citizen", "mafia", "doctor", "sheriff", "maniac")
+NIGHT_ROLES = ("mafia", "doctor", "sheriff", "maniac")
+# Ночные роли, которым не показываем в списке целей своих же
+OWN_ROLE_EXCLUDED = ("mafia", "sheriff", "maniac")
+
+MAFIA = "Мафия"
+MANIAC = "Маньяк"
+CITIZENS = "Горожане"
+
+# Фракция роли; все остальные роли играют за горожан
+FACTIONS = {"mafia": MAFIA, "maniac": MANIAC}
+# Коды победителя в архиве партий - индексы в этом кортеже
+WINNERS = (CITIZENS, MAFIA, MANIAC)
+
+# Боты-заполнители получают id 0..BOT_IDS-1 и в статистику не попадают
+BOT_IDS = 5
+
+# Длительность фазы, пока чат не настроен через /config
+DEFAULT_TIMER = 30
+
+# Меньше игроков - партию добирают ботами
+MIN_PLAYERS = 5
+
+# Причины выбывания: убит ночью, выгнан голосованием, выгнан за АФК
+DEATH_CAUSES = ("killed", "voted", "kicked")
+
+
+class PhaseResult(NamedTuple):
+    killed: list
+    kicked: list
+    winner: str | None
+    alive: list
+
+
+def deal_roles(n: int, mafia_count: int = None) -> list:
+    # Перемешанные роли на n игроков; без настройки мафий - 30% стола
+    if mafia_count is None:
+        mafia_count = max(1, int(n * 0.3))
+    roles = ["mafia"] * mafia_count
+    special_roles = [role for role, need in (("doctor", 5), ("sheriff", 6), ("maniac", 7)) if n >= need]
+    roles.extend(special_roles[:max(0, n - len(roles))])
+    roles.extend(["citizen"] * (n - len(roles)))
+    random.shuffle(roles)
+    return roles
+
+
+def top_target(targets) -> int | None:
+    # Самая популярная цель, при равенстве - та, за которую проголосовали раньше
+    counts = Counter(targets)
+    if not counts:
+        return None
+    return counts.most_common(1)[0][0]
+
+
+def can_vote(vote_type: str, role: str) -> bool:
+    # Днём голосуют все, ночью - только своя роль
+    return vote_type == "citizen" or vote_type == role
+
+
+def faction(role: str) -> str:
+    return FACTIONS.get(role, CITIZENS)
+
+
+def winner(mafia_alive: int, maniac_alive: int, citizen_alive: int) -> str | None:
+    if maniac_alive > 0 and mafia_alive == 0 and citizen_alive <= 1:
+        return MANIAC
+
+    if mafia_alive >= (citizen_alive + maniac_alive) and mafia_alive > 0:
+        return MAFIA
+
+    if mafia_alive == 0 and maniac_alive == 0:
+        return CITIZENS
+
+    return None
@@ -0,0 +1,126 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import log
+import metrics
+
+
+class Handle:
+    __slots__ = ("when", "seq", "func", "args", "cancelled")
+
+    def __init__(self, when: float, seq: int, func, args: tuple):
+        self.when = when
+        self.seq = seq
+        self.func = func
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class Scheduler:
+    """Один поток с кучей дедлайнов вместо threading.Timer на каждую фазу.
+
+    Сработавшие дедлайны выполняются в ограниченном пуле потоков.
+    """
+
+    def __init__(self, workers: int = 8, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="phase")
+        self._cancelled = 0
+        self._running = True
+
+        self.fired = 0
+        self.lag_total = 0.0
+        self.lag_max = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def call_later(self, delay: float, func, *args) -> Handle:
+        with self._cond:
+            handle = Handle(self.clock() + delay, next(self._seq), func, args)
+            heapq.heappush(self._heap, handle)
+            if self._heap[0] is handle:
+                self._cond.notify()
+            return handle
+
+    def cancel(self, handle: Handle | None) -> None:
+        if handle is None or handle.cancelled:
+            return
+        with self._cond:
+            handle.cancel()
+            self._cancelled += 1
+            # Чистим кучу, когда отменённых записей накопилось слишком много
+            if self._cancelled > len(self._heap) // 2:
+                self._heap = [h for h in self._heap if not h.cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def reschedule(self, handle: Handle | None, delay: float) -> Handle | None:
+        if handle is None or handle.cancelled:
+            return None
+        self.cancel(handle)
+        return self.call_later(delay, handle.func, *handle.args)
+
+    def pending(self) -> int:
+        with self._cond:
+            return sum(1 for h in self._heap if not h.cancelled)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending(),
+            "fired": self.fired,
+            "lag_avg": self.lag_total / self.fired if self.fired else 0.0,
+            "lag_max": self.lag_max,
+        }
+
+    def shutdown(self) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._thread.join()
+        self._pool.shutdown(wait=True)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    while self._heap and self._heap[0].cancelled:
+                        heapq.heappop(self._heap)
+                        self._cancelled = max(0, self._cancelled - 1)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    timeout = self._heap[0].when - self.clock()
+                    if timeout <= 0:
+                        break
+                    self._cond.wait(timeout)
+                if not self._running:
+                    return
+                handle = heapq.heappop(self._heap)
+            self._pool.submit(self._dispatch, handle)
+
+    def _dispatch(self, handle: Handle):
+        if handle.cancelled:
+            return
+        lag = self.clock() - handle.when
+        with self._cond:
+            self.fired += 1
+            self.lag_total += lag
+            self.lag_max = max(self.lag_max, lag)
+        metrics.observe("scheduler_lag_seconds", lag)
+        try:
+            handle.func(*handle.args)
+        except Exception:
+            log.exception("scheduler", "callback failed", func=getattr(handle.func, "__name__", str(handle.func)))
@@ -0,0 +1,287 @@
+"""Горизонтальное шардирование: супервизор и N процессов-воркеров.
+
+Супервизор один забирает апдейты через getUpdates и раздаёт их воркерам по
+чату (jump consistent hash от chat_id). Каждый воркер - обычный bot.py со
+своим файлом SQLite (shard-<i>.db) и журналом партий (events-<i>/), так что
+ни GIL, ни единственный писатель SQLite не общие для всех чатов. Общий и
+ролевой рейтинги собираются со всех шардов на чтение (db.SHARDS).
+
+    python shards.py --workers 4
+    python shards.py rebalance --from 4 --to 6     # при остановленном боте
+
+По умолчанию воркеров столько же, сколько ядер (SHARD_WORKERS).
+"""
+import argparse
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+from telebot import apihelper
+
+import log
+import metrics
+
+BASE_DIR = Path(__file__).resolve().parent
+SHARD_DIR = Path(os.getenv("SHARD_DIR", BASE_DIR / "shards"))
+
+# Таблицы, строки которых принадлежат чату и переезжают вместе с ним
+CHAT_TABLES = ("players", "votes", "settings", "chat_stats", "games")
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    # Jump consistent hash (Lamping, Veach): при смене N переезжает ~1/N чатов
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, j = -1, 0
+    while j < buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * (1 << 31) / ((key >> 33) + 1))
+    return bucket
+
+
+def shard_path(directory: Path, index: int) -> Path:
+    return Path(directory) / f"shard-{index}.db"
+
+
+def events_path(directory: Path, index: int) -> Path:
+    return Path(directory) / f"events-{index}"
+
+
+def update_chat(update: dict) -> int:
+    # Чат, которому принадлежит апдейт. Ночные голоса приходят из лички,
+    # но относятся к чату партии из callback_data (см. bot.callback_chat)
+    callback = update.get("callback_query")
+    if callback:
+        parts = (callback.get("data") or "").split("|")
+        if parts[0] == "v" and len(parts) > 1:
+            try:
+                return int(parts[1])
+            except ValueError:
+                pass
+        message = callback.get("message")
+        return message["chat"]["id"] if message else callback["from"]["id"]
+    for kind in ("message", "edited_message", "my_chat_member", "chat_member"):
+        if kind in update:
+            return update[kind]["chat"]["id"]
+    return 0
+
+
+def worker_main(index: int, count: int, directory: str, queue) -> None:
+    # Окружение шарда задаём до импорта bot: db, eventlog и outbox читают его при импорте
+    directory = Path(directory)
+    os.environ["DB_PATH"] = str(shard_path(directory, index))
+    os.environ["EVENTS_DIR"] = str(events_path(directory, index))
+    os.environ["DB_SHARDS"] = os.pathsep.join(str(shard_path(directory, i)) for i in range(count))
+    if os.getenv("METRICS_PORT"):
+        os.environ["METRICS_PORT"] = str(int(os.environ["METRICS_PORT"]) + 1 + index)
+    if os.getenv("METRICS_DUMP"):
+        os.environ["METRICS_DUMP"] = f"{os.environ['METRICS_DUMP']}.{index}"
+
+    import outbox
+    # Общий лимит Bot API делится между воркерами
+    outbox.GLOBAL_RATE = outbox.GLOBAL_RATE / count
+
+    import bot
+    from telebot import types
+
+    metrics.start_from_env()
+    bot.recover_games()
+    log.info("shards", "worker started", shard=index, pid=os.getpid())
+    while True:
+        raw = queue.get()
+        if raw is None:
+            break
+        bot.bot.process_new_updates([types.Update.de_json(raw)])
+    bot.outbox.flush(timeout=10)
+    bot.writer.flush()
+    log.flush()
+
+
+class Supervisor:
+    def __init__(self, workers: int, token: str, directory: Path = SHARD_DIR):
+        if workers < 1:
+            raise ValueError("workers must be positive")
+        self.workers = workers
+        self.token = token
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queues = [self._ctx.Queue() for _ in range(workers)]
+        self.processes = [None] * workers
+        self._running = True
+
+    def _start(self, index: int) -> None:
+        process = self._ctx.Process(target=worker_main, name=f"shard-{index}", daemon=True,
+                                    args=(index, self.workers, str(self.directory), self.queues[index]))
+        process.start()
+        self.processes[index] = process
+
+    def _check(self) -> None:
+        # Упавший воркер поднимаем заново: его партии восстановятся из журнала
+        for index, process in enumerate(self.processes):
+            if process is None or not process.is_alive():
+                if process is not None:
+                    log.warning("shards", "worker restarted", shard=index, exitcode=process.exitcode)
+                    metrics.inc("shard_restarts_total", shard=index)
+                self._start(index)
+            metrics.gauge("shard_queue_depth", self.queues[index].qsize(), shard=index)
+
+    def route(self, update: dict) -> int:
+        return jump_hash(update_chat(update), self.workers)
+
+    def run(self) -> None:
+        offset = 0
+        while self._running:
+            self._check()
+            try:
+                updates = apihelper.get_updates(self.token, offset, 100, timeout=30, long_polling_timeout=20)
+            except Exception:
+                log.exception("shards", "getUpdates failed")
+                time.sleep(1)
+                continue
+            for update in updates:
+                shard = self.route(update)
+                self.queues[shard].put(update)
+                metrics.inc("shard_updates_total", shard=shard)
+                offset = update["update_id"] + 1
+
+    def stop(self) -> None:
+        self._running = False
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            if process is not None:
+                process.join(timeout=15)
+
+
+def rebalance(directory: Path, old: int, new: int) -> dict:
+    """Переносит чаты при смене числа шардов с old на new. Бот должен быть остановлен.
+
+    Строки чата (CHAT_TABLES) и журналы его партий переезжают в шард
+    jump_hash(chat_id, new). Личная статистика (stats, role_stats) складывается
+    по игрокам на чтение, поэтому трогаем её только у выбывающих шардов:
+    она суммируется в шард jump_hash(user_id, new), а сам файл остаётся
+    рядом с суффиксом .retired.
+
+    Каждая пара шардов переносится своей транзакцией, к которой подключён
+    только целевой файл, поэтому число шардов не упирается в лимит ATTACH.
+    Перенесённое удаляется из источника в той же транзакции, и прерванный
+    rebalance можно просто запустить заново.
+    """
+    import db
+
+    directory = Path(directory)
+    if new < 1:
+        raise ValueError("new shard count must be positive")
+    for index in range(max(old, new)):
+        db.DB_PATH = shard_path(directory, index)
+        db.init_db()
+    db.close_pool()
+
+    moved = {}
+    for index in range(old):
+        retired = index >= new
+        conn = sqlite3.connect(shard_path(directory, index), isolation_level=None)
+        conn.create_function("jump_hash", 2, jump_hash, deterministic=True)
+        try:
+            chats = {row[0] for table in CHAT_TABLES for row in conn.execute(f"SELECT DISTINCT chat_id FROM {table}")}
+            moves = [(chat_id, jump_hash(chat_id, new)) for chat_id in chats]
+            moves = [(chat_id, target) for chat_id, target in moves if target != index]
+            conn.execute("CREATE TEMP TABLE moves (chat_id INTEGER PRIMARY KEY, target INTEGER)")
+            conn.executemany("INSERT INTO moves VALUES (?, ?)", moves)
+
+            targets = range(new) if retired else sorted({target for _, target in moves})
+            for target in targets:
+                conn.execute("ATTACH DATABASE ? AS t", (str(shard_path(directory, target)),))
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    _move_chats(conn, target)
+                    if retired:
+                        _merge_player_stats(conn, new, target)
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+                finally:
+                    conn.execute("DETACH DATABASE t")
+            if retired:
+                # Всё из WAL - в основной файл, чтобы отложить шард одним файлом
+                conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+
+        for chat_id, target in moves:
+            source = events_path(directory, index) / f"{chat_id}.log"
+            if source.exists():
+                events_path(directory, target).mkdir(parents=True, exist_ok=True)
+                shutil.move(source, events_path(directory, target) / source.name)
+        if retired:
+            path = shard_path(directory, index)
+            path.rename(f"{path}.retired")
+            for suffix in ("-wal", "-shm"):
+                Path(f"{path}{suffix}").unlink(missing_ok=True)
+        moved[index] = len(moves)
+        log.info("shards", "rebalanced", shard=index, chats=len(moves), retired=retired)
+    return moved
+
+
+def _move_chats(conn: sqlite3.Connection, target: int) -> None:
+    # Строки чатов, уезжающих в подключённый как t шард
+    for table in CHAT_TABLES:
+        columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})") if row[1] != "id")
+        conn.execute(f"""INSERT INTO t.{table} ({columns}) SELECT {columns} FROM main.{table}
+                         WHERE chat_id IN (SELECT chat_id FROM moves WHERE target={target})""")
+        conn.execute(f"DELETE FROM main.{table} WHERE chat_id IN (SELECT chat_id FROM moves WHERE target={target})")
+
+
+def _merge_player_stats(conn: sqlite3.Connection, new: int, target: int) -> None:
+    # Статистика выбывающего шарда суммируется с уже лежащей в целевом
+    conn.execute(f"""
+        INSERT INTO t.stats(user_id, username, games, wins)
+        SELECT user_id, username, games, wins FROM main.stats WHERE jump_hash(user_id, {new}) = {target}
+        ON CONFLICT(user_id) DO UPDATE SET games = games + excluded.games, wins = wins + excluded.wins
+    """)
+    conn.execute(f"""
+        INSERT INTO t.role_stats(role, user_id, username, games, wins)
+        SELECT role, user_id, username, games, wins FROM main.role_stats
+        WHERE jump_hash(user_id, {new}) = {target}
+        ON CONFLICT(role, user_id) DO UPDATE SET games = games + excluded.games, wins = wins + excluded.wins
+    """)
+    conn.execute("INSERT OR IGNORE INTO t.media SELECT * FROM main.media")
+    conn.execute(f"DELETE FROM main.stats WHERE jump_hash(user_id, {new}) = {target}")
+    conn.execute(f"DELETE FROM main.role_stats WHERE jump_hash(user_id, {new}) = {target}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", type=Path, default=SHARD_DIR)
+    parser.add_argument("--workers", type=int, default=int(os.getenv("SHARD_WORKERS", os.cpu_count() or 1)))
+    commands = parser.add_subparsers(dest="command")
+    move = commands.add_parser("rebalance", help="перенести чаты на другое число шардов")
+    move.add_argument("--from", dest="old", type=int, required=True)
+    move.add_argument("--to", dest="new", type=int, required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == "rebalance":
+        for index, count in rebalance(args.dir, args.old, args.new).items():
+            print(f"shard {index}: moved {count} chats")
+        return
+
+    load_dotenv(BASE_DIR / ".env")
+    api_url = os.getenv("TELEGRAM_API_URL")
+    if api_url:
+        apihelper.API_URL = api_url.rstrip("/") + "/bot{0}/{1}"
+    metrics.start_from_env()
+    supervisor = Supervisor(args.workers, os.getenv("TOKEN"), args.dir)
+    try:
+        supervisor.run()
+    except KeyboardInterrupt:
+        supervisor.stop()
+
+
+if __name__ == "__main__":
+    main()
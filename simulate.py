@@ -0,0 +1,287 @@
+"""Безголовый прогон партий и бенчмарк игрового и storage-слоя.
+
+Партии идут целиком через db.py и логику bot.py (game_start, game_loop_step,
+callback_worker), но вместо Telegram - FakeBot, а вместо реальных таймеров -
+виртуальные часы. Игроки-люди нажимают кнопки из присланных им клавиатур.
+
+    python simulate.py                       # все сценарии
+    python simulate.py --scenario mixed --games 5000 --chats 500
+"""
+import argparse
+import contextlib
+import heapq
+import io
+import itertools
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+os.environ.setdefault("TOKEN", "0:simulation")
+if "DB_PATH" not in os.environ:
+    os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="mafia-sim-"), "sim.db")
+os.environ.setdefault("EVENTS_DIR", os.path.join(os.path.dirname(os.environ["DB_PATH"]), "events"))
+os.environ.setdefault("LOG_LEVEL", "warning")
+
+import bot
+import bots
+import db
+import metrics
+
+
+SCENARIOS = {
+    # Только боты: лобби добивается до 5 игроков
+    "bots": {"humans": 0, "click_rate": 0.0},
+    # Несколько людей и боты
+    "mixed": {"humans": 3, "click_rate": 0.9},
+    # Большое лобби из людей без ботов
+    "large": {"humans": 12, "click_rate": 0.9},
+}
+
+
+class VirtualScheduler:
+    """Тот же интерфейс, что у scheduler.Scheduler, но время виртуальное."""
+
+    def __init__(self):
+        self.now = 0.0
+        self._heap = []
+        self._seq = itertools.count()
+        self.fired = 0
+
+    def call_later(self, delay, func, *args):
+        handle = SimpleNamespace(when=self.now + delay, func=func, args=args, cancelled=False)
+        heapq.heappush(self._heap, (handle.when, next(self._seq), handle))
+        return handle
+
+    def cancel(self, handle):
+        if handle is not None:
+            handle.cancelled = True
+
+    def reschedule(self, handle, delay):
+        if handle is None or handle.cancelled:
+            return None
+        self.cancel(handle)
+        return self.call_later(delay, handle.func, *handle.args)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._heap), "fired": self.fired, "lag_avg": 0.0, "lag_max": 0.0}
+
+    def step(self) -> bool:
+        while self._heap:
+            when, _, handle = heapq.heappop(self._heap)
+            if handle.cancelled:
+                continue
+            self.now = when
+            self.fired += 1
+            handle.func(*handle.args)
+            return True
+        return False
+
+
+class FakeBot:
+    """Заглушка TeleBot: запоминает клавиатуры, на которые надо нажать."""
+
+    def __init__(self):
+        self.me = SimpleNamespace(id=1, username="mafia_sim_bot")
+        self.sent = 0
+        self.keyboards = []
+
+    def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.sent += 1
+        if reply_markup is not None:
+            self.keyboards.append((chat_id, json.loads(reply_markup)))
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        self.sent += 1
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), photo=[SimpleNamespace(file_id="sim-photo")])
+
+    def answer_callback_query(self, callback_query_id, text=None, show_alert=None, **kwargs):
+        return True
+
+    def get_chat_member(self, chat_id, user_id):
+        return SimpleNamespace(status="creator")
+
+    def get_me(self):
+        return self.me
+
+
+class InstantOutbox:
+    """Outbox без очереди и лимитов: отправляет сразу в вызывающем потоке."""
+
+    def send_message(self, chat_id, text, on_error=None, **kwargs):
+        try:
+            bot.bot.send_message(chat_id, text, **kwargs)
+        except Exception as exc:
+            if on_error is None:
+                raise
+            on_error(exc)
+
+    def call(self, chat_id, func, on_error=None):
+        try:
+            func(bot.bot)
+        except Exception as exc:
+            if on_error is None:
+                raise
+            on_error(exc)
+
+    def flush(self, timeout=None):
+        return True
+
+
+class InlineActors:
+    """Почтовые ящики без пула: вызов выполняется сразу, как в одном потоке."""
+
+    def submit(self, chat_id, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+
+class InlineWriter:
+    def submit(self, func, *args, **kwargs):
+        func(*args, **kwargs)
+
+    def flush(self):
+        pass
+
+
+def percentile(values, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def message(chat_id, user_id, name, text):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id), from_user=SimpleNamespace(id=user_id, first_name=name),
+                           text=text, message_id=0)
+
+
+class Simulation:
+    def __init__(self, games: int, chats: int, humans: int, click_rate: float, seed: int,
+                 strategy: str = "random"):
+        self.target_games = games
+        self.chats = chats
+        self.humans = humans
+        self.click_rate = click_rate
+        self.rng = random.Random(seed)
+        random.seed(seed)
+
+        self.fake = FakeBot()
+        self.clock = VirtualScheduler()
+        self.members = {}
+        self.started = 0
+        self.finished = 0
+        self.running = set()
+        self.phases = 0
+        self.phase_latency = []
+
+        bot.bot = self.fake
+        bot.scheduler = self.clock
+        bot.outbox = InstantOutbox()
+        bot.writer = InlineWriter()
+        bot.actors = InlineActors()
+        bot.bot_strategy = bots.make(strategy, seed)
+
+    def start_game(self, chat_id):
+        if self.started >= self.target_games:
+            return
+        self.started += 1
+        if self.started <= self.chats:
+            for user_id in self.members[chat_id]:
+                bot.reg_in_group(message(chat_id, user_id, f"user{user_id}", "/reg"))
+        bot.game_start(message(chat_id, self.members[chat_id][0] if self.members[chat_id] else 1, "admin", "/game"))
+        self.running.add(chat_id)
+
+    def phase_step(self, chat_id, phase=None):
+        # При досрочном завершении фазы следующий шаг выполняется вложенно,
+        # поэтому конец партии засчитываем по множеству running
+        began = time.perf_counter()
+        self._game_loop_step(chat_id, phase)
+        self.phase_latency.append(time.perf_counter() - began)
+        self.phases += 1
+        if chat_id in self.running and not bot.get_game(chat_id).active:
+            self.running.discard(chat_id)
+            self.finished += 1
+            self.clock.call_later(1, self.start_game, chat_id)
+
+    def click(self):
+        # Люди нажимают случайную кнопку в каждой присланной клавиатуре
+        keyboards, self.fake.keyboards = self.fake.keyboards, []
+        for chat_id, markup in keyboards:
+            voters = self.members.get(chat_id, [chat_id])
+            buttons = [row[0] for row in markup["inline_keyboard"]]
+            for user_id in voters:
+                if not buttons or self.rng.random() >= self.click_rate:
+                    continue
+                button = self.rng.choice(buttons)
+                call = SimpleNamespace(id="0", data=button["callback_data"],
+                                       from_user=SimpleNamespace(id=user_id, first_name=f"user{user_id}"))
+                bot.callback_worker(call)
+
+    def run(self, db_path: str) -> dict:
+        db.DB_PATH = db_path
+        db.close_pool()
+        db.init_db()
+        statements = metrics.registry.total("db_statements_total")
+        commits = metrics.registry.total("db_commits_total")
+
+        # Перехватываем game_loop_step, чтобы мерить время каждой фазы
+        self._game_loop_step = bot.game_loop_step
+        bot.game_loop_step = self.phase_step
+
+        for n in range(self.chats):
+            chat_id = -1_000_000 - n
+            self.members[chat_id] = [10_000 + n * 100 + i for i in range(self.humans)]
+            self.clock.call_later(self.rng.random(), self.start_game, chat_id)
+
+        began = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            while self.clock.step():
+                self.click()
+        elapsed = time.perf_counter() - began
+        bot.game_loop_step = self._game_loop_step
+        db.close_pool()
+
+        phases = max(self.phases, 1)
+        return {
+            "games": self.finished,
+            "games_per_sec": self.finished / elapsed if elapsed else 0.0,
+            "phases": self.phases,
+            "queries_per_phase": (metrics.registry.total("db_statements_total") - statements) / phases,
+            "commits_per_phase": (metrics.registry.total("db_commits_total") - commits) / phases,
+            "phase_p50_ms": percentile(self.phase_latency, 0.50) * 1000,
+            "phase_p99_ms": percentile(self.phase_latency, 0.99) * 1000,
+            "messages": self.fake.sent,
+            "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "virtual_hours": self.clock.now / 3600,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), action="append")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--strategy", choices=sorted(bots.STRATEGIES), default="random")
+    args = parser.parse_args(argv)
+
+    workdir = os.path.dirname(str(db.DB_PATH))
+    for name in args.scenario or SCENARIOS:
+        bot.games.clear()
+        simulation = Simulation(args.games, args.chats, seed=args.seed, strategy=args.strategy, **SCENARIOS[name])
+        result = simulation.run(os.path.join(workdir, f"{name}.db"))
+        print(f"[{name}]")
+        for key, value in result.items():
+            print(f"  {key:18} {value:.2f}" if isinstance(value, float) else f"  {key:18} {value}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
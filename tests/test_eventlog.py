@@ -0,0 +1,111 @@
+import eventlog
+from game import Game
+
+CHAT = -100
+GAME_ID = 1792306491599
+PLAYERS = [
+    (0, "bot", "mafia"),
+    (10, "a", "mafia"),
+    (11, "b", "doctor"),
+    (12, "c", "sheriff"),
+    (13, "d", "maniac"),
+    (14, "e", "citizen"),
+    (15, "f", "citizen"),
+    (16, "g", "citizen"),
+]
+
+
+def snapshot(game: Game) -> dict:
+    return {
+        "game_id": game.game_id,
+        "active": game.active,
+        "night": game.night,
+        "phase": game.phase,
+        "alive": set(game.alive),
+        "voted": set(game.voted),
+        "votes": list(game.votes),
+        "players": {pid: (p.role, p.afk_count, p.death_phase, p.death_cause) for pid, p in game.players.items()},
+    }
+
+
+def play(events: eventlog.EventLog) -> Game:
+    # Партия так, как её ведёт bot.py: журнал пишется через game.journal
+    game = Game(CHAT)
+    game.load(PLAYERS)
+    game.game_id = GAME_ID
+    game.active = True
+    game.journal = lambda *event: events.append(CHAT, *event)
+    events.start(CHAT, game.get_players_roles(), GAME_ID)
+
+    # День 0: ничья 14/15 - никого не выгоняют; 0, 14, 15, 16 не голосуют
+    game.cast_votes([("citizen", 14, 10), ("citizen", 15, 11), ("citizen", 14, 12), ("citizen", 15, 13)])
+    game.resolve_phase(False)
+    game.night = True
+    events.append(CHAT, "t", 1000.0, True)
+    events.flush(CHAT)
+
+    # Ночь 1: мафия делит голоса 16/12 - побеждает цель, названная раньше
+    game.cast_votes([("mafia", 16, 0), ("mafia", 12, 10), ("doctor", 12, 11),
+                     ("maniac", 14, 13), ("sheriff", 13, 12)])
+    game.resolve_phase(True)
+    game.night = False
+    events.append(CHAT, "t", 2000.0, False)
+    events.flush(CHAT)
+
+    # День 2: второй пропуск подряд - бот 0 выгнан за АФК
+    game.cast_vote("citizen", 15, 10)
+    game.resolve_phase(False)
+    game.night = True
+    events.append(CHAT, "t", 3000.0, True)
+
+    # Ночь 3 ещё идёт
+    game.cast_votes([("mafia", 11, 10), ("doctor", 11, 11)])
+    events.flush(CHAT)
+    return game
+
+
+def test_replay_matches_live_game(tmp_path):
+    events = eventlog.EventLog(tmp_path)
+    live = play(events)
+
+    (game, deadline), = events.recover()
+
+    assert snapshot(game) == snapshot(live)
+    assert deadline == 3000.0
+
+
+def test_replay_keeps_tie_break_and_afk(tmp_path):
+    events = eventlog.EventLog(tmp_path)
+    play(events)
+
+    game, _ = eventlog.replay(CHAT, (tmp_path / f"{CHAT}.log").read_text(encoding="utf-8").splitlines())
+
+    assert game.players[16].death_cause == "killed" and game.players[16].death_phase == 1
+    assert 12 in game.alive
+    assert game.players[0].death_cause == "kicked" and game.players[0].death_phase == 2
+    assert game.players[11].afk_count == 1
+    assert game.votes == [("mafia", 11), ("doctor", 11)]
+
+
+def test_truncated_last_line_is_ignored(tmp_path):
+    events = eventlog.EventLog(tmp_path)
+    play(events)
+    path = tmp_path / f"{CHAT}.log"
+    lines = path.read_text(encoding="utf-8").splitlines()
+
+    expected, _ = eventlog.replay(CHAT, lines)
+    # Падение посреди записи: последний голос дописан наполовину
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('["v","maniac",1')
+    (game, deadline), = events.recover()
+
+    assert snapshot(game) == snapshot(expected)
+    assert deadline == 3000.0
+
+
+def test_finished_game_is_not_recovered(tmp_path):
+    events = eventlog.EventLog(tmp_path)
+    play(events)
+    events.end(CHAT)
+
+    assert events.recover() == []
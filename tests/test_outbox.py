@@ -0,0 +1,182 @@
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import pytest
+
+import outbox
+from outbox import Item, Outbox
+
+
+@pytest.fixture(autouse=True)
+def fast_limits(monkeypatch):
+    # Проверяем порядок и склейку, а не сами лимиты Telegram
+    for name in ("GLOBAL_RATE", "PRIVATE_RATE", "PRIVATE_BURST"):
+        monkeypatch.setattr(outbox, name, 1000.0)
+
+
+class TooManyRequests(Exception):
+    error_code = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__("Too Many Requests")
+        self.result_json = {"parameters": {"retry_after": retry_after}}
+
+
+class Client:
+    def __init__(self):
+        self.sent = []
+        self.failures = 0
+
+    def send_message(self, chat_id, text, **kwargs):
+        if self.failures:
+            self.failures -= 1
+            raise TooManyRequests(0.05)
+        self.sent.append((chat_id, text, kwargs))
+
+
+def batch(*items) -> list:
+    return Outbox(lambda: None, workers=0)._batch(deque(items))
+
+
+def test_batch_merges_plain_texts():
+    items = batch(Item(1, "a"), Item(1, "b"), Item(1, "c"))
+    assert [item.text for item in items] == ["a", "b", "c"]
+
+
+def test_batch_ends_with_keyboard():
+    queue = deque([Item(1, "a"), Item(1, "vote", {"reply_markup": "{}"}), Item(1, "after")])
+    items = Outbox(lambda: None, workers=0)._batch(queue)
+    assert [item.text for item in items] == ["a", "vote"]
+    assert [item.text for item in queue] == ["after"]
+
+
+def test_batch_does_not_merge_calls_or_callbacks():
+    call = Item(1, call=lambda client: None)
+    assert batch(call, Item(1, "a")) == [call]
+
+    first = Item(1, "a")
+    assert batch(first, Item(1, "b", on_error=print)) == [first]
+    # Сообщение с kwargs само по себе не склеивается с последующими
+    reply = Item(1, "a", {"reply_to_message_id": 5})
+    assert batch(reply, Item(1, "b")) == [reply]
+
+
+def test_batch_respects_max_text():
+    long = "x" * (outbox.MAX_TEXT - 1)
+    first = Item(1, long)
+    assert batch(first, Item(1, "y")) == [first]
+
+
+def test_retry_after_429_keeps_order():
+    client = Client()
+    client.failures = 1
+    box = Outbox(lambda: client, workers=2)
+    calls = []
+
+    def first(c):
+        calls.append("first")
+        c.send_message(7, "first")
+
+    box.call(7, first)
+    box.send_message(7, "second")
+    box.send_message(7, "third")
+    assert box.flush(timeout=5)
+
+    # Первый запрос получил 429 и ушёл повторно раньше стоявших за ним
+    assert calls == ["first", "first"]
+    assert [text for _, text, _ in client.sent] == ["first", "second\nthird"]
+    assert box.stats() == {"queued": 0, "sent": 2, "merged": 1, "retried": 1, "failed": 0}
+
+
+def test_retried_batch_is_resent_as_one_message():
+    client = Client()
+    client.failures = 1
+    box = Outbox(lambda: client, workers=1)
+
+    box.send_message(8, "a")
+    box.send_message(8, "b")
+    assert box.flush(timeout=5)
+    box.send_message(8, "c")
+    assert box.flush(timeout=5)
+
+    assert [text for _, text, _ in client.sent] == ["a\nb", "c"]
+    assert box.stats()["retried"] == 1
+
+
+def test_gives_up_after_max_retries():
+    client = Client()
+    client.failures = outbox.MAX_RETRIES + 1
+    errors = []
+    box = Outbox(lambda: client, workers=1)
+
+    box.send_message(9, "lost", on_error=errors.append)
+    box.send_message(9, "next")
+    assert box.flush(timeout=10)
+
+    assert len(errors) == 1 and isinstance(errors[0], TooManyRequests)
+    assert [text for _, text, _ in client.sent] == ["next"]
+    assert box.stats()["failed"] == 1
+
+
+class AsyncClient:
+    # Как AsyncBridge: запрос сразу возвращает незавершённый Future
+    def __init__(self):
+        self.futures = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        future = Future()
+        self.futures.append((chat_id, text, future))
+        return future
+
+
+def test_async_sends_do_not_hold_workers():
+    client = AsyncClient()
+    box = Outbox(lambda: client, workers=1)
+
+    box.send_message(-1, "a")
+    box.send_message(-2, "b")
+    # Один поток, но оба запроса уже в пути
+    assert wait(lambda: len(client.futures) == 2)
+    box.send_message(-1, "c")
+    assert not box.flush(timeout=0.2)
+    # Следующее сообщение чата уходит только после ответа на предыдущее
+    assert [text for _, text, _ in client.futures] == ["a", "b"]
+
+    for _, _, future in client.futures[:2]:
+        future.set_result(None)
+    assert wait(lambda: len(client.futures) == 3)
+    client.futures[2][2].set_exception(TooManyRequests(0.05))
+    assert wait(lambda: len(client.futures) == 4)
+    client.futures[3][2].set_result(None)
+    assert box.flush(timeout=5)
+
+    assert [text for _, text, _ in client.futures] == ["a", "b", "c", "c"]
+    assert box.stats() == {"queued": 0, "sent": 3, "merged": 0, "retried": 1, "failed": 0}
+
+
+def wait(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_idle_buckets_are_dropped():
+    now = [0.0]
+    client = Client()
+    box = Outbox(lambda: client, workers=1, clock=lambda: now[0])
+
+    box.send_message(1, "a")
+    box.send_message(2, "b")
+    assert box.flush(timeout=5)
+    assert set(box._buckets) == {1, 2}
+
+    # Ведро чата 1 успело наполниться, чат 2 только что писал
+    now[0] = outbox.PRUNE_INTERVAL
+    box._buckets[2].stamp = now[0]
+    box.send_message(3, "c")
+    assert box.flush(timeout=5)
+    assert set(box._buckets) == {2, 3}